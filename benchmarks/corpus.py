@@ -0,0 +1,148 @@
+"""Replay corpus for the mail-parsing benchmark.
+
+Synthetic courier notifications are generated deterministically from a seed,
+in the shapes seen in real mailboxes: plain text, multipart/alternative,
+HTML-only, mails with attachments, national charsets, large newsletters and
+mail without any tracking code. Anonymized real mails can be added as .eml
+files; the expected code goes in an X-Expected-Tracking-Code header.
+"""
+import random
+import string
+from email.message import EmailMessage
+from email.parser import BytesHeaderParser
+from pathlib import Path
+
+EXPECTED_HEADER = "X-Expected-Tracking-Code"
+SAMPLES_DIR = Path(__file__).parent / "corpus"
+
+def random_digits(rng, count):
+    return "".join(rng.choice(string.digits) for _ in range(count))
+
+COURIERS = {
+    "InPost": ("inpost.pl", lambda rng: random_digits(rng, 24)),
+    "DPD": ("dpd.com.pl", lambda rng: random_digits(rng, 13) + rng.choice(string.ascii_uppercase)),
+    "DHL": ("dhl.com", lambda rng: "JJD" + random_digits(rng, 21)),
+    "Pocztex": ("pocztex.pl", lambda rng: "PX" + random_digits(rng, 10)),
+    "Allegro": ("allegro.pl", lambda rng: "A000" + "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(6))),
+}
+
+LABELS = ["Numer przesyłki", "Nr przesyłki", "Numer paczki", "Tracking number", "Śledź przesyłkę"]
+
+FILLER = [
+    "Dziękujemy za zakupy w naszym sklepie.",
+    "Paczka zostanie dostarczona w ciągu 1-2 dni roboczych.",
+    "W razie pytań skontaktuj się z biurem obsługi klienta pod numerem 22 123 45 67.",
+    "Zamówienie nr {order} z dnia {day}.05.2024 zostało przekazane do wysyłki.",
+    "Wartość zamówienia: {price},99 zł. Koszt dostawy: 12,99 zł.",
+    "Ta wiadomość została wygenerowana automatycznie, prosimy na nią nie odpowiadać.",
+]
+
+def _filler(rng, count):
+    return " ".join(
+        rng.choice(FILLER).format(order=random_digits(rng, 9), day=rng.randint(10, 28), price=rng.randint(20, 900))
+        for _ in range(count)
+    )
+
+def _notification_text(rng, courier, code):
+    return (
+        f"Dzień dobry,\n\n{_filler(rng, 2)}\n\n"
+        f"Przewoźnik: {courier}\n{rng.choice(LABELS)}: {code}\n\n{_filler(rng, 3)}\n"
+    )
+
+def _notification_html(rng, courier, code):
+    rows = "".join(f"<tr><td>{_filler(rng, 1)}</td></tr>" for _ in range(3))
+    return (
+        f"<html><body><table>{rows}<tr><td><b>Przewoźnik: {courier}</b></td></tr>"
+        f"<tr><td>{rng.choice(LABELS)}: <a href=\"https://{COURIERS[courier][0]}/track?n={code}\">{code}</a></td></tr>"
+        f"</table><p>{_filler(rng, 2)}</p></body></html>"
+    )
+
+def _newsletter_html(rng, size):
+    items = []
+    while sum(map(len, items)) < size:
+        items.append(
+            f"<tr><td><img src=\"https://cdn.example.com/p/{random_digits(rng, 12)}.jpg\"></td>"
+            f"<td>Produkt {random_digits(rng, 8)} teraz {rng.randint(10, 999)},99 zł</td>"
+            f"<td>EAN {random_digits(rng, 13)}</td></tr>"
+        )
+    return f"<html><body><table>{''.join(items)}</table></body></html>"
+
+def _message(courier, subject):
+    msg = EmailMessage()
+    domain = COURIERS[courier][0] if courier else "sklep.example.com"
+    msg["From"] = f"Powiadomienia <noreply@{domain}>"
+    msg["To"] = "odbiorca@example.com"
+    msg["Subject"] = subject
+    return msg
+
+def _plain(rng, courier, code):
+    msg = _message(courier, f"{courier}: Twoja paczka jest w drodze")
+    msg.set_content(_notification_text(rng, courier, code))
+    return msg
+
+def _alternative(rng, courier, code):
+    msg = _message(courier, f"Przesyłka {courier} została nadana")
+    msg.set_content(_notification_text(rng, courier, code))
+    msg.add_alternative(_notification_html(rng, courier, code), subtype="html")
+    return msg
+
+def _html_only(rng, courier, code):
+    msg = _message(courier, f"{courier} - informacja o przesyłce")
+    msg.set_content(_notification_html(rng, courier, code), subtype="html")
+    return msg
+
+def _with_attachment(rng, courier, code):
+    msg = _message(courier, f"Etykieta {courier} dla Twojego zamówienia")
+    msg.set_content(_notification_text(rng, courier, code))
+    msg.add_attachment(rng.randbytes(64 * 1024), maintype="application", subtype="pdf", filename="etykieta.pdf")
+    return msg
+
+def _latin2(rng, courier, code):
+    msg = _message(courier, f"{courier}: przesyłka w drodze")
+    msg.set_content(_notification_text(rng, courier, code), charset="iso-8859-2")
+    return msg
+
+def _newsletter_with_code(rng, courier, code):
+    msg = _message(courier, "Promocje tygodnia i status Twojego zamówienia")
+    html = _newsletter_html(rng, 150 * 1024)
+    position = len(html) // 2
+    msg.set_content(html[:position] + _notification_html(rng, courier, code) + html[position:], subtype="html")
+    return msg
+
+def _newsletter(rng, courier, code):
+    msg = _message(None, "Wyprzedaż -70% tylko do niedzieli")
+    msg.set_content(_newsletter_html(rng, 200 * 1024), subtype="html")
+    return msg
+
+# (kind, builder, share of the corpus, carries a tracking code)
+SHAPES = [
+    ("plain", _plain, 30, True),
+    ("alternative", _alternative, 25, True),
+    ("html_only", _html_only, 15, True),
+    ("attachment", _with_attachment, 10, True),
+    ("latin2", _latin2, 10, True),
+    ("newsletter_with_code", _newsletter_with_code, 5, True),
+    ("newsletter", _newsletter, 5, False),
+]
+
+def generate(count, seed=0):
+    """Return count (kind, raw RFC822 bytes, expected code or None) tuples."""
+    rng = random.Random(seed)
+    kinds = [shape for shape in SHAPES for _ in range(shape[2])]
+    corpus = []
+    for _ in range(count):
+        kind, builder, _, has_code = rng.choice(kinds)
+        courier = rng.choice(list(COURIERS))
+        code = COURIERS[courier][1](rng)
+        msg = builder(rng, courier, code)
+        corpus.append((kind, msg.as_bytes(), code if has_code else None))
+    return corpus
+
+def load_samples(directory=SAMPLES_DIR):
+    """Return (kind, raw bytes, expected code or None) for every .eml file in directory."""
+    samples = []
+    for path in sorted(Path(directory).glob("*.eml")):
+        raw = path.read_bytes()
+        expected = BytesHeaderParser().parsebytes(raw).get(EXPECTED_HEADER)
+        samples.append((f"sample:{path.stem}", raw, expected.strip() if expected else None))
+    return samples
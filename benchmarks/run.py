@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""Offline replay benchmarks for the DoorDrop mail-parsing and scan paths.
+
+    python benchmarks/run.py                      # run both suites and compare with baseline.json
+    python benchmarks/run.py --suite parse --messages 5000 --corpus ~/anonymized-mail
+    python benchmarks/run.py --update-baseline    # record this machine's numbers as the baseline
+
+The parse suite replays the corpus through MessageParser, the same code the
+worker processes run. The scan suite drives the real ScanDispatcher,
+CodeAuthorizer, ActiveCodeIndex and DeactivationQueue through an in-process
+stand-in MQTT broker and database, one sequential client per gate like the
+real scanners. Neither suite needs Home Assistant. The exit status is 1 when
+a suite falls below its baseline, cannot run, or a single message takes
+longer than --max-message-ms.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import platform
+import random
+import sys
+import time
+import types
+from collections import defaultdict
+from pathlib import Path
+
+import corpus
+
+ROOT = Path(__file__).resolve().parent.parent
+INTEGRATION_DIR = ROOT / "custom_components" / "doordrop"
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+QUANTILES = (0.5, 0.99)
+
+def load_integration_module(name):
+    """Import doordrop.<name> without running the Home Assistant setup in the package __init__."""
+    if "doordrop" not in sys.modules:
+        package = types.ModuleType("doordrop")
+        package.__path__ = [str(INTEGRATION_DIR)]
+        sys.modules["doordrop"] = package
+    return importlib.import_module(f"doordrop.{name}")
+
+def install_home_assistant_stand_ins():
+    """Provide the Home Assistant names the scan path imports, when Home Assistant is not installed.
+
+    Only the module-level imports need them: the suite passes its own hass
+    and storage, and never starts the resync or retry timers.
+    """
+    try:
+        import homeassistant  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    def module(name, **attributes):
+        sys.modules[name] = types.ModuleType(name)
+        sys.modules[name].__dict__.update(attributes)
+
+    module("homeassistant", __path__=[])
+    module("homeassistant.core", HomeAssistant=object, callback=lambda func: func)
+    module("homeassistant.exceptions", HomeAssistantError=type("HomeAssistantError", (Exception,), {}))
+    module("homeassistant.helpers", __path__=[])
+    module("homeassistant.helpers.event", async_track_time_interval=lambda hass, action, interval: lambda: None)
+    module("homeassistant.helpers.storage", Store=None)
+
+def quantiles(samples):
+    """Return {quantile: value} using the nearest-rank method, as metrics.LatencyWindow does."""
+    samples = sorted(samples)
+    if not samples:
+        return {q: 0.0 for q in QUANTILES}
+    return {q: samples[min(len(samples) - 1, int(q * len(samples)))] for q in QUANTILES}
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+def run_parse_suite(args):
+    parser_module = load_integration_module("parser")
+    messages = corpus.generate(args.messages, args.seed) + corpus.load_samples()
+    if args.corpus:
+        messages += corpus.load_samples(args.corpus)
+
+    parser = parser_module.MessageParser()
+    for _, raw, _ in messages[:20]:
+        try:
+            parser.parse(raw)
+        except Exception:
+            pass
+
+    totals, bodies, extractions = [], [], []
+    slowest = (0.0, None)
+    hits = expected_codes = errors = 0
+    started = time.perf_counter()
+    for kind, raw, expected in messages:
+        start = time.perf_counter()
+        try:
+            result = parser.parse(raw)
+        except Exception:
+            errors += 1
+            result = None
+        elapsed = time.perf_counter() - start
+        totals.append(elapsed)
+        if elapsed > slowest[0]:
+            slowest = (elapsed, kind)
+        if result is not None:
+            bodies.append(result.parse_seconds)
+            extractions.append(result.extract_seconds)
+        if expected is not None:
+            expected_codes += 1
+            hits += result is not None and result.candidate is not None and result.candidate.code == expected
+    wall = time.perf_counter() - started
+
+    total_q, body_q, extract_q = quantiles(totals), quantiles(bodies), quantiles(extractions)
+    report = {
+        "messages": len(messages),
+        "messages_per_sec": round(len(messages) / wall, 1),
+        "p50_ms": _ms(total_q[0.5]),
+        "p99_ms": _ms(total_q[0.99]),
+        "max_ms": _ms(slowest[0]),
+        "slowest_kind": slowest[1],
+        "body_p50_ms": _ms(body_q[0.5]),
+        "body_p99_ms": _ms(body_q[0.99]),
+        "extract_p50_ms": _ms(extract_q[0.5]),
+        "extract_p99_ms": _ms(extract_q[0.99]),
+        "accuracy": round(hits / expected_codes, 4) if expected_codes else None,
+        "errors": errors,
+    }
+    if args.profile_patterns:
+        report["slowest_patterns"] = profile_patterns(messages)
+    return report
+
+def profile_patterns(messages):
+    """Replay the corpus with per-pattern statistics on; return the five slowest patterns."""
+    registry = load_integration_module("pattern_registry").PatternRegistry()
+    parser = load_integration_module("parser").MessageParser(registry.current, collect_stats=True)
+    for _, raw, _ in messages:
+        try:
+            result = parser.parse(raw)
+        except Exception:
+            continue
+        if result.pattern_stats:
+            registry.stats.record(result.pattern_version, result.pattern_stats)
+    return dict(list(registry.stats.as_dict()["patterns"].items())[:5])
+
+class StandInBroker:
+    """In-process MQTT stand-in delivering each publish after a fixed network delay."""
+
+    def __init__(self, latency):
+        self._latency = latency
+        self._subscribers = defaultdict(list)
+        self._deliveries = set()
+
+    def subscribe(self, topic, callback):
+        self._subscribers[topic].append(callback)
+
+    async def publish(self, topic, payload):
+        loop = asyncio.get_running_loop()
+        message = types.SimpleNamespace(topic=topic, payload=payload.encode())
+        for callback in self._subscribers[topic]:
+            loop.call_later(self._latency, self._deliver, callback, message)
+
+    def _deliver(self, callback, message):
+        result = callback(message)
+        if asyncio.iscoroutine(result):
+            task = asyncio.ensure_future(result)
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+class StandInHass:
+    """The part of HomeAssistant the scan path uses: tasks on the running loop."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self._tasks = set()
+
+    def async_create_task(self, target, name=None):
+        task = self.loop.create_task(target, name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def async_block_till_done(self):
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+class StandInStore:
+    """In-memory stand-in for the HA storage file of the deactivation queue."""
+
+    def __init__(self):
+        self.data = None
+
+    async def async_load(self):
+        return self.data
+
+    def async_delay_save(self, data_func, delay=0):
+        self.data = data_func()
+
+    async def async_save(self, data):
+        self.data = data
+
+class StandInDatabase:
+    """Shipments table stand-in answering after a fixed round trip."""
+
+    def __init__(self, active_codes, latency):
+        self.active_codes = set(active_codes)
+        self._latency = latency
+
+    async def is_code_active(self, code):
+        await asyncio.sleep(self._latency)
+        return code in self.active_codes
+
+    async def fetch_active_codes(self):
+        await asyncio.sleep(self._latency)
+        return list(self.active_codes)
+
+    async def deactivate_codes(self, checked_dates):
+        await asyncio.sleep(self._latency)
+        self.active_codes.difference_update(checked_dates)
+        return []
+
+async def _scan_path(args):
+    install_home_assistant_stand_ins()
+    metrics = load_integration_module("metrics").Metrics()
+    allowlist = load_integration_module("allowlist").AuthorizedBarcodes("BADGE-0001, COURIER-*")
+    rules = load_integration_module("code_matcher").normalization_rules(
+        load_integration_module("pattern_registry").build_courier_patterns().patterns
+    )
+
+    loop = asyncio.get_running_loop()
+    hass = StandInHass()
+    rng = random.Random(args.seed)
+    active = [corpus.COURIERS["InPost"][1](rng) for _ in range(args.scans)]
+    database = StandInDatabase(active, args.db_latency / 1000)
+    # The same objects the sensor wires together, minus the periodic timers
+    index = load_integration_module("code_cache").ActiveCodeIndex(hass, database.fetch_active_codes, rules=rules)
+    if not args.no_index:
+        await index.async_resync()
+    deactivations = load_integration_module("write_behind").DeactivationQueue(hass, database, "benchmark", metrics, StandInStore())
+    authorizer = load_integration_module("authorizer").CodeAuthorizer(hass, database, index, deactivations, allowlist, metrics)
+    dispatcher = load_integration_module("dispatcher").ScanDispatcher(hass, authorizer.authorize, metrics)
+    broker = StandInBroker(args.broker_latency / 1000)
+    replies = {}
+
+    def make_gate(gate):
+        scan_topic, status_topic = f"doordrop/gate{gate}/scan", f"doordrop/gate{gate}/status"
+
+        async def on_scan(message):
+            authorized = await dispatcher.dispatch(message.payload.decode(), message.topic)
+            await broker.publish(status_topic, "Authorized" if authorized else "Unauthorized")
+
+        def on_status(message):
+            replies[gate].set_result(message.payload.decode())
+
+        broker.subscribe(scan_topic, on_scan)
+        broker.subscribe(status_topic, on_status)
+        return scan_topic
+
+    # Every active code is scanned once and a third of them straight away again (a courier's retry),
+    # mixed with unknown codes and allow-listed badges
+    workload = []
+    for code in active:
+        workload.append(code)
+        if rng.random() < 0.3:
+            workload.append(code)
+        if rng.random() < 0.3:
+            workload.append(corpus.random_digits(rng, 24))
+        if rng.random() < 0.1:
+            workload.append(rng.choice(["BADGE-0001", f"COURIER-{rng.randint(1, 99)}"]))
+    lanes = [workload[gate::args.gates] for gate in range(args.gates)]
+
+    latencies = []
+    outcomes = defaultdict(int)
+
+    async def scanner(gate, codes):
+        scan_topic = make_gate(gate)
+        for code in codes:
+            replies[gate] = loop.create_future()
+            start = time.perf_counter()
+            await broker.publish(scan_topic, code)
+            outcomes[await replies[gate]] += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(scanner(gate, codes) for gate, codes in enumerate(lanes)))
+    wall = time.perf_counter() - started
+    await hass.async_block_till_done()
+    await deactivations.async_flush()
+
+    latency_q = quantiles(latencies)
+    return {
+        "scans": len(latencies),
+        "scans_per_sec": round(len(latencies) / wall, 1),
+        "p50_ms": _ms(latency_q[0.5]),
+        "p99_ms": _ms(latency_q[0.99]),
+        "max_ms": _ms(max(latencies, default=0.0)),
+        "authorized": outcomes["Authorized"],
+        "unauthorized": outcomes["Unauthorized"],
+        "cache_hits": metrics.as_dict()["counters"].get("scan_cache_hits", 0),
+        "left_active": len(database.active_codes),
+    }
+
+def run_scan_suite(args):
+    return asyncio.run(_scan_path(args))
+
+SUITES = {
+    "parse": (run_parse_suite, "messages_per_sec"),
+    "scan": (run_scan_suite, "scans_per_sec"),
+}
+
+def check(name, report, baseline, args):
+    """Return a list of regressions of report against its baseline entry."""
+    failures = []
+    if report.get("max_ms", 0) > args.max_message_ms and name == "parse":
+        failures.append(f"slowest message took {report['max_ms']} ms ({report['slowest_kind']}), limit {args.max_message_ms} ms")
+    if report.get("left_active"):
+        failures.append(f"{report['left_active']} scanned codes are still active in the stand-in database")
+    if baseline is None:
+        return failures
+    throughput_key = SUITES[name][1]
+    floor = baseline[throughput_key] * (1 - args.tolerance)
+    if report[throughput_key] < floor:
+        failures.append(f"{throughput_key} {report[throughput_key]} below baseline {baseline[throughput_key]} (floor {floor:.1f})")
+    if baseline.get("accuracy") is not None and (report.get("accuracy") or 0) < baseline["accuracy"]:
+        failures.append(f"accuracy {report['accuracy']} below baseline {baseline['accuracy']}")
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--suite", choices=["all", *SUITES], default="all")
+    parser.add_argument("--messages", type=int, default=1000, help="synthetic messages in the parse corpus")
+    parser.add_argument("--corpus", help="directory of extra anonymized .eml files to replay")
+    parser.add_argument("--scans", type=int, default=2000, help="active codes in the scan workload")
+    parser.add_argument("--gates", type=int, default=4, help="scanners scanning concurrently")
+    parser.add_argument("--broker-latency", type=float, default=0.5, help="stand-in broker delivery delay in ms")
+    parser.add_argument("--db-latency", type=float, default=2.0, help="stand-in database round trip in ms")
+    parser.add_argument("--no-index", action="store_true", help="look every scan up in the database, as before the index loads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profile-patterns", action="store_true", help="also report the five slowest patterns")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed throughput drop below the baseline")
+    parser.add_argument("--max-message-ms", type=float, default=1000.0, help="fail when any single message takes longer")
+    args = parser.parse_args(argv)
+
+    baselines = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    names = list(SUITES) if args.suite == "all" else [args.suite]
+    reports, failures = {}, []
+    for name in names:
+        try:
+            report = SUITES[name][0](args)
+        except ImportError as e:
+            # A suite that cannot run must not pass the gate
+            print(f"{name}: cannot run, {e}")
+            failures.append(f"{name}: missing dependency {e.name}")
+            continue
+        reports[name] = report
+        print(f"{name}: {json.dumps(report)}")
+        for failure in check(name, report, None if args.update_baseline else baselines.get(name), args):
+            failures.append(f"{name}: {failure}")
+
+    if args.update_baseline:
+        for name, report in reports.items():
+            baselines[name] = {
+                key: report[key] for key in (SUITES[name][1], "p50_ms", "p99_ms", "accuracy") if key in report
+            }
+        baselines["recorded_on"] = f"{platform.python_implementation()} {platform.python_version()} {platform.machine()}"
+        args.baseline.write_text(json.dumps(baselines, indent=4) + "\n")
+        print(f"Baseline written to {args.baseline}")
+
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,147 @@
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
-from homeassistant.components.mqtt import async_subscribe
-from .const import AUTHORIZED_BARCODES
+from homeassistant.core import HomeAssistant, ServiceCall, SupportsResponse
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+from homeassistant.util.yaml import load_yaml
+import homeassistant.helpers.config_validation as cv
+import voluptuous as vol
+from .const import (
+    AUTHORIZED_BARCODES, CONF_DB_HOST, CONF_DB_PORT, CONF_DB_USERNAME, CONF_DB_PASSWORD, CONF_DB_NAME, PATTERNS_FILE
+)
+from .database import ShipmentDatabase
+from .metrics import Metrics
+from .scan_log import ScanLog
+from .allowlist import AuthorizedBarcodes
+from .fallback_store import FallbackStore
+from .code_cache import ActiveCodeIndex
+from .code_matcher import normalization_rules
+from .bulk_import import async_import_codes, read_import_file
+from .pattern_registry import PatternRegistry, build_courier_patterns
+from .views import DoorDropMetricsView
+from .mail import mail_sources
 import logging
 import asyncio
-
-# Import the sensor platform to ensure it's loaded
-from . import sensor
+import os
 
 _LOGGER = logging.getLogger(__name__)
 DOMAIN = "doordrop"
 PLATFORMS = ["sensor"]
 
+ADD_SHIPMENT_SCHEMA = vol.All(
+    vol.Schema({
+        vol.Optional("code"): vol.All(cv.ensure_list, [cv.string]),
+        vol.Optional("file"): cv.string,
+        vol.Optional("entry_id"): cv.string,
+    }),
+    cv.has_at_least_one_key("code", "file"),
+)
+
+async def async_setup(hass: HomeAssistant, config):
+    """Register the metrics endpoint and the services shared by all config entries."""
+    hass.data.setdefault(DOMAIN, {})
+    hass.http.register_view(DoorDropMetricsView)
+
+    async def async_reload_patterns(call: ServiceCall):
+        """Validate the courier definitions file and swap it into every entry."""
+        try:
+            courier_patterns = await _async_load_courier_patterns(hass)
+        except (ValueError, HomeAssistantError) as e:
+            raise HomeAssistantError(f"Invalid courier patterns in {PATTERNS_FILE}: {e}") from e
+        for data in hass.data[DOMAIN].values():
+            data['patterns'].swap(courier_patterns)
+
+    async def async_add_shipment(call: ServiceCall):
+        """Register shipment codes given directly or in a CSV/JSON file in the config directory.
+
+        Responds with the inserted, duplicate and invalid counts of each entry.
+        """
+        codes = list(call.data.get("code", []))
+        if "file" in call.data:
+            try:
+                codes += await hass.async_add_executor_job(read_import_file, hass.config.config_dir, call.data["file"])
+            except (ValueError, OSError) as e:
+                raise HomeAssistantError(f"Cannot import {call.data['file']}: {e}") from e
+
+        entry_ids = [call.data["entry_id"]] if "entry_id" in call.data else list(hass.data[DOMAIN])
+        results = {}
+        for entry_id in entry_ids:
+            data = hass.data[DOMAIN].get(entry_id)
+            if data is None:
+                raise HomeAssistantError(f"Unknown DoorDrop entry {entry_id}")
+            try:
+                counts = await async_import_codes(data['database'], data['code_index'], codes)
+            except Exception as e:
+                raise HomeAssistantError(f"Adding shipments failed: {e}") from e
+            _LOGGER.info("Added shipments: %d new, %d duplicates, %d invalid", counts["inserted"], counts["duplicates"], counts["invalid"])
+            results[entry_id] = counts
+        return results
+
+    hass.services.async_register(DOMAIN, "reload_patterns", async_reload_patterns)
+    hass.services.async_register(
+        DOMAIN, "add_shipment", async_add_shipment, schema=ADD_SHIPMENT_SCHEMA, supports_response=SupportsResponse.OPTIONAL
+    )
+    return True
+
+async def _async_load_courier_patterns(hass: HomeAssistant):
+    """Load and compile-check the courier definitions file, or the built-in couriers if there is none."""
+    path = hass.config.path(PATTERNS_FILE)
+
+    def load():
+        if not os.path.exists(path):
+            return build_courier_patterns()
+        return build_courier_patterns(load_yaml(path))
+
+    return await hass.async_add_executor_job(load)
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
     """Setup config entry for Home Assistant."""
     _LOGGER.debug("Setting up DoorDrop component.")
     _LOGGER.debug("Entry data: %s", entry.data)
 
+    database = ShipmentDatabase(
+        entry.data[CONF_DB_HOST],
+        entry.data[CONF_DB_PORT],
+        entry.data[CONF_DB_USERNAME],
+        entry.data[CONF_DB_PASSWORD],
+        entry.data[CONF_DB_NAME]
+    )
+    try:
+        await database.setup()
+    except Exception as e:
+        # The schema is retried on the first successful connection
+        _LOGGER.error("Database setup failed: %s", str(e))
+
+    fallback = FallbackStore(hass, hass.config.path(f"doordrop_{entry.entry_id}.db"))
+    try:
+        await fallback.async_setup()
+    except Exception as e:
+        _LOGGER.error("Local fallback store setup failed, continuing without it: %s", str(e))
+        fallback = None
+
+    try:
+        patterns = PatternRegistry(await _async_load_courier_patterns(hass))
+    except (ValueError, HomeAssistantError) as e:
+        _LOGGER.error("Invalid courier patterns in %s, using the built-in couriers: %s", PATTERNS_FILE, str(e))
+        patterns = PatternRegistry()
+
+    code_index = ActiveCodeIndex(hass, database.fetch_active_codes, fallback, rules=normalization_rules(patterns.current.patterns))
+    entry.async_on_unload(patterns.add_listener(lambda current: code_index.set_rules(normalization_rules(current.patterns))))
+
     hass.data.setdefault(DOMAIN, {})
     hass.data[DOMAIN][entry.entry_id] = {
-        'config': dict(entry.data)
+        'config': dict(entry.data),
+        'database': database,
+        'fallback': fallback,
+        'metrics': Metrics(),
+        'scan_log': ScanLog(),
+        # Push-only coordinator carrying the result of the latest batch of mail codes
+        'mail_batches': DataUpdateCoordinator(hass, _LOGGER, name=DOMAIN),
+        'authorized_barcodes': AuthorizedBarcodes(_authorized_barcodes_text(entry)),
+        'patterns': patterns,
+        'code_index': code_index,
+        'mail_sources': mail_sources(entry.data, entry.options)
     }
+    entry.async_on_unload(entry.add_update_listener(async_update_options))
 
     _LOGGER.debug("Forwarding entry setup to sensor platform...")
     try:
@@ -40,8 +161,20 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry):
     """Unload a config entry."""
     unload_ok = await hass.config_entries.async_forward_entry_unloads(entry, PLATFORMS)
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id, None)
+        data = hass.data[DOMAIN].pop(entry.entry_id, None)
+        if data is not None:
+            await data['database'].close()
+            if data['fallback'] is not None:
+                await data['fallback'].async_close()
     return unload_ok
 
-def is_authorized_barcode(barcode, authorized_barcodes):
-    return barcode in authorized_barcodes.split(",")
\ No newline at end of file
+async def async_update_options(hass: HomeAssistant, entry: ConfigEntry):
+    """Apply options flow changes, reloading the entry only when the mail accounts changed."""
+    data = hass.data[DOMAIN][entry.entry_id]
+    if mail_sources(entry.data, entry.options) != data['mail_sources']:
+        hass.async_create_task(hass.config_entries.async_reload(entry.entry_id))
+        return
+    data['authorized_barcodes'].load(_authorized_barcodes_text(entry))
+
+def _authorized_barcodes_text(entry):
+    return entry.options.get(AUTHORIZED_BARCODES, entry.data.get(AUTHORIZED_BARCODES, ""))
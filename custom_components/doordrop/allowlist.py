@@ -0,0 +1,79 @@
+import logging
+from datetime import date
+
+_LOGGER = logging.getLogger(__name__)
+
+_TERMINAL = object()  # trie key holding the expiry of a prefix rule ending at that node
+
+class AuthorizedBarcodes:
+    """Static allow-list of barcodes that always open the gate.
+
+    Entries are separated by commas or new lines. An entry ending in "*" is a
+    prefix rule, and "@YYYY-MM-DD" after an entry sets the last day it is
+    valid, e.g. "BADGE-0042, COURIER-*@2026-12-31". Lookups are a set
+    membership test plus a walk over a prefix trie, independent of the size
+    of the list.
+    """
+
+    def __init__(self, text=""):
+        self.load(text)
+
+    def load(self, text):
+        """Rebuild the allow-list from its configuration text."""
+        exact = {}
+        trie = {}
+        for raw_entry in (text or "").replace("\n", ",").split(","):
+            entry, expiry = self._parse_entry(raw_entry)
+            if not entry:
+                continue
+            if entry == "*":
+                _LOGGER.error("Ignoring authorized barcode rule '*', which would match every code")
+                continue
+            if entry.endswith("*"):
+                node = trie
+                for char in entry[:-1]:
+                    node = node.setdefault(char, {})
+                node[_TERMINAL] = expiry
+            else:
+                exact[entry] = expiry
+        # Swapped in one step so concurrent scans see either the old or the new list
+        self._permanent, self._expiring, self._trie = (
+            frozenset(code for code, expiry in exact.items() if expiry is None),
+            {code: expiry for code, expiry in exact.items() if expiry is not None},
+            trie,
+        )
+
+    @staticmethod
+    def _parse_entry(raw_entry):
+        entry, _, expiry_text = raw_entry.strip().partition("@")
+        entry = entry.strip()
+        expiry = None
+        if expiry_text.strip():
+            try:
+                expiry = date.fromisoformat(expiry_text.strip())
+            except ValueError:
+                _LOGGER.error("Ignoring authorized barcode %s with invalid expiry date: %s", entry, expiry_text)
+                return None, None
+        return entry, expiry
+
+    def __contains__(self, code):
+        code = code.strip()
+        if code in self._permanent:
+            return True
+        if code in self._expiring and self._is_valid(self._expiring[code]):
+            return True
+        node = self._trie
+        for char in code:
+            if _TERMINAL in node and self._is_valid(node[_TERMINAL]):
+                return True
+            node = node.get(char)
+            if node is None:
+                return False
+        return _TERMINAL in node and self._is_valid(node[_TERMINAL])
+
+    @staticmethod
+    def _is_valid(expiry):
+        return expiry is None or date.today() <= expiry
+
+    def __len__(self):
+        return len(self._permanent) + len(self._expiring)
@@ -0,0 +1,107 @@
+import logging
+from .code_matcher import CodeMatch
+from .database import DatabaseTimeout
+
+_LOGGER = logging.getLogger(__name__)
+
+def count_db_error(metrics, error):
+    """Count a failed database call as a timeout or another error."""
+    metrics.increment("db_timeouts" if isinstance(error, DatabaseTimeout) else "db_errors")
+
+class CodeAuthorizer:
+    """Decide whether a scanned code opens the gate and use it up if so.
+
+    Holds the scan path behind the dispatcher: the allow-list, the active
+    code index with the database as fallback, and the write-behind
+    deactivations. It has no entity state, so the scan benchmark drives the
+    same code as the sensor.
+    """
+
+    def __init__(self, hass, database, code_index, deactivations, authorized_barcodes, metrics, fallback=None):
+        self.hass = hass
+        self._database = database
+        self._code_index = code_index
+        self._deactivations = deactivations
+        self._authorized_barcodes = authorized_barcodes
+        self._metrics = metrics
+        self._fallback = fallback
+
+    async def authorize(self, code):
+        """Return the CodeMatch of an accepted scan after using up its stored code, or None."""
+        # Allow-listed barcodes are checked first and are never used up
+        if self.is_authorized_barcode(code):
+            return CodeMatch(code, "allowlist")
+        with self._metrics.timer("scan_lookup"):
+            match = await self.find_active_code(code)
+        # A database lookup yields, so another gate may have used the code meanwhile
+        if match is not None and self._deactivations.is_tombstoned(match.code):
+            return None
+        if match is not None:
+            # The stored code is tombstoned here; the database write happens behind the reply
+            with self._metrics.timer("scan_status_update"):
+                await self.update_code_status(match.code, False)
+        return match
+
+    def is_authorized_barcode(self, barcode):
+        """Check if the barcode is in the list of authorized barcodes."""
+        _LOGGER.debug("Checking if barcode is authorized: %s", barcode)
+        return barcode in self._authorized_barcodes
+
+    async def find_active_code(self, code):
+        """Return the CodeMatch of the active code a scan resolves to, or None.
+
+        Once the in-memory index is loaded a scan may also resolve to a stored
+        code it contains or normalizes to; before that only exact
+        database lookups are made.
+        """
+        if self._deactivations.is_tombstoned(code):
+            _LOGGER.debug("Code %s was already used", code)
+            return None
+        if self._code_index.loaded:
+            _LOGGER.debug("Checking if code is in active code index: %s", code)
+            match = self._code_index.match(code)
+            if match is None or self._deactivations.is_tombstoned(match.code):
+                return None
+            if match.rule != "exact":
+                _LOGGER.info("Scanned code %s matched stored code %s (%s)", code, match.code, match.rule)
+            return match
+        _LOGGER.debug("Checking if code is in database: %s", code)
+        try:
+            active = await self._database.is_code_active(code)
+        except Exception as e:
+            _LOGGER.error("Error checking code in the database: %s", str(e))
+            count_db_error(self._metrics, e)
+            return None
+        return CodeMatch(code, "exact") if active else None
+
+    async def update_code_status(self, code, active):
+        """Update the active status of a shipment code; deactivations are written behind."""
+        _LOGGER.debug("Updating code status in database: %s, active: %s", code, active)
+        # Update the index first so a deactivated code cannot be reused while the write is in flight
+        if not active:
+            self._code_index.discard(code)
+            self._deactivations.enqueue(code)
+            self._mirror_code_use(code, True)
+            return
+        self._deactivations.cancel(code)
+        self._mirror_code_use(code, False)
+        self._code_index.add(code)
+        try:
+            await self._database.set_code_active(code, active)
+        except Exception as e:
+            _LOGGER.error("Error updating code status in the database: %s", str(e))
+            count_db_error(self._metrics, e)
+
+    def _mirror_code_use(self, code, used):
+        """Record a used or reactivated code in the local fallback store behind the reply."""
+        if self._fallback is not None:
+            self.hass.async_create_task(self._async_mirror_code_use(code, used))
+
+    async def _async_mirror_code_use(self, code, used):
+        try:
+            if used:
+                await self._fallback.async_mark_used([code])
+            else:
+                await self._fallback.async_unmark_used([code])
+        except Exception as e:
+            _LOGGER.error("Error recording a used code in the local fallback store: %s", str(e))
@@ -0,0 +1,86 @@
+import csv
+import json
+from pathlib import Path
+from .const import IMPORT_CHUNK_SIZE
+from .database import SHIPMENT_CODE_PATTERN
+
+# Column names marketplace exports use for the tracking number
+CODE_COLUMNS = {"code", "tracking", "tracking_number", "tracking number", "numer przesyłki", "numer_przesylki", "waybill"}
+
+def split_codes(values):
+    """Return (unique valid codes in input order, number of invalid values)."""
+    valid = {}
+    invalid = 0
+    for value in values:
+        code = str(value).strip()
+        if SHIPMENT_CODE_PATTERN.fullmatch(code):
+            valid[code] = None
+        else:
+            invalid += 1
+    return list(valid), invalid
+
+def resolve_import_path(config_dir, name):
+    """Return the path of an import file, which must be inside the config directory."""
+    config_dir = Path(config_dir).resolve()
+    path = (config_dir / name).resolve()
+    if not path.is_relative_to(config_dir):
+        raise ValueError(f"{name} is outside the configuration directory")
+    if not path.is_file():
+        raise ValueError(f"{name} does not exist")
+    return path
+
+def read_import_file(config_dir, name):
+    """Resolve an import file inside the config directory and read its codes. Blocking."""
+    return read_codes_file(resolve_import_path(config_dir, name))
+
+def read_codes_file(path):
+    """Read raw code values from a CSV or JSON export. Blocking.
+
+    JSON may be a list of codes, a list of objects with a code column, or an
+    object with a "codes" list. CSV uses the first column named like a
+    tracking number column, else the first column.
+    """
+    path = Path(path)
+    text = path.read_text(encoding="utf-8-sig")
+    if path.suffix.lower() == ".json":
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("codes", [])
+        if not isinstance(data, list):
+            raise ValueError("JSON import must be a list of codes or an object with a 'codes' list")
+        return [_code_from_object(item) if isinstance(item, dict) else item for item in data]
+
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    rows = [row for row in csv.reader(text.splitlines(), dialect) if row]
+    if not rows:
+        return []
+    header = [cell.strip().lower() for cell in rows[0]]
+    column = next((index for index, name in enumerate(header) if name in CODE_COLUMNS), None)
+    if column is None:
+        column = 0
+        if SHIPMENT_CODE_PATTERN.fullmatch(rows[0][0].strip()):
+            return [row[0] for row in rows]
+    return [row[column] if column < len(row) else "" for row in rows[1:]]
+
+def _code_from_object(item):
+    return next((value for key, value in item.items() if key.strip().lower() in CODE_COLUMNS), "")
+
+async def async_import_codes(database, code_index, codes, chunk_size=IMPORT_CHUNK_SIZE):
+    """Upsert valid codes in chunked transactions and mark the active ones in the index.
+
+    Returns {"inserted", "duplicates", "invalid"} counts. Chunks written
+    before a database error stay written.
+    """
+    valid, invalid = split_codes(codes)
+    counts = {"inserted": 0, "duplicates": len(codes) - len(valid) - invalid, "invalid": invalid}
+    for start in range(0, len(valid), chunk_size):
+        result = await database.upsert_codes(valid[start:start + chunk_size])
+        counts["inserted"] += result.inserted
+        counts["duplicates"] += result.duplicates
+        if code_index is not None:
+            for code in result.active:
+                code_index.add(code)
+    return counts
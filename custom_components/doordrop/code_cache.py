@@ -0,0 +1,114 @@
+import logging
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.event import async_track_time_interval
+from .const import DEFAULT_CODE_RESYNC_INTERVAL
+from .code_matcher import CodeMatcher
+
+_LOGGER = logging.getLogger(__name__)
+
+class ActiveCodeIndex:
+    """Resident set of active shipment codes mirrored from the shipments table.
+
+    Besides exact membership, match() resolves a scanned barcode that differs
+    from the stored code, e.g. a longer label barcode, using the courier
+    normalization rules set with set_rules().
+    """
+
+    def __init__(self, hass: HomeAssistant, load_codes, fallback=None, resync_interval=DEFAULT_CODE_RESYNC_INTERVAL, rules=()):
+        """load_codes is a coroutine function returning an iterable of active codes.
+
+        fallback is an optional FallbackStore that mirrors every snapshot and
+        seeds the index when the database is unreachable at startup.
+        """
+        self.hass = hass
+        self._load_codes = load_codes
+        self._fallback = fallback
+        self._resync_interval = resync_interval
+        self._codes = CodeMatcher()
+        self._rules = list(rules)
+        self._loaded = False
+        self._resyncing = False
+        self._pending = {}
+        self._unsub_resync = None
+
+    @property
+    def loaded(self):
+        """Return True once the index has been filled from the database at least once."""
+        return self._loaded
+
+    def __contains__(self, code):
+        return code in self._codes
+
+    def __len__(self):
+        return len(self._codes)
+
+    def match(self, code):
+        """Return the CodeMatch of the active code a scanned barcode resolves to, or None."""
+        return self._codes.match(code, self._rules)
+
+    def set_rules(self, rules):
+        """Replace the courier normalization rules, e.g. after the courier patterns were reloaded."""
+        self._rules = list(rules)
+
+    def add(self, code):
+        """Mark a code as active."""
+        self._codes.add(code)
+        if self._resyncing:
+            self._pending[code] = True
+
+    def discard(self, code):
+        """Mark a code as no longer active."""
+        self._codes.discard(code)
+        if self._resyncing:
+            self._pending[code] = False
+
+    async def async_start(self):
+        """Load the index and schedule periodic resyncs with the database."""
+        await self.async_resync()
+        self._unsub_resync = async_track_time_interval(self.hass, self.async_resync, self._resync_interval)
+
+    def async_stop(self):
+        """Cancel the periodic resync."""
+        if self._unsub_resync is not None:
+            self._unsub_resync()
+            self._unsub_resync = None
+
+    async def async_resync(self, now=None):
+        """Replace the index with a fresh snapshot of the active codes in the database."""
+        if self._resyncing:
+            return
+        self._resyncing = True
+        self._pending = {}
+        from_database = True
+        try:
+            codes = await self._load_codes()
+        except Exception as e:
+            _LOGGER.error("Error loading active codes from the database: %s", str(e))
+            if self._loaded or self._fallback is None:
+                return
+            try:
+                codes = await self._fallback.async_load_active()
+            except Exception as e:
+                _LOGGER.error("Error loading active codes from the local fallback store: %s", str(e))
+                return
+            _LOGGER.warning("Serving %d active codes from the local fallback store until the database is back", len(codes))
+            from_database = False
+        finally:
+            self._resyncing = False
+
+        # Changes made while the snapshot was being read win over the snapshot itself
+        snapshot = set(codes)
+        for code, active in self._pending.items():
+            if active:
+                snapshot.add(code)
+            else:
+                snapshot.discard(code)
+        self._pending = {}
+        self._codes = CodeMatcher(snapshot)
+        self._loaded = True
+        _LOGGER.debug("Active code index resynced: %d codes", len(snapshot))
+        if from_database and self._fallback is not None:
+            try:
+                await self._fallback.async_replace_active(snapshot)
+            except Exception as e:
+                _LOGGER.error("Error mirroring active codes to the local fallback store: %s", str(e))
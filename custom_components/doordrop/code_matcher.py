@@ -0,0 +1,90 @@
+import re
+from collections import Counter
+from typing import NamedTuple
+from .const import MIN_TOLERANT_MATCH_LENGTH
+from .search_patterns import literal_prefix
+
+class CodeMatch(NamedTuple):
+    code: str  # the stored code the scan resolved to
+    rule: str  # how it matched: exact, a courier normalization or contained
+
+class NormalizationRule(NamedTuple):
+    provider: str
+    prefix: str
+    regex: re.Pattern
+
+def normalization_rules(patterns):
+    """Derive prefix rules from the courier code patterns, e.g. DHL "JJD" + 21 digits.
+
+    A scan may carry the literal prefix while the stored code lacks it, as
+    long as the scan fullmatches the pattern. The other way round is not
+    matched: a scan shorter than the stored code must not open the gate.
+    """
+    rules = []
+    for provider, entries in patterns.items():
+        for pattern in entries if isinstance(entries, list) else [entries]:
+            prefix = literal_prefix(pattern)
+            if prefix:
+                rules.append(NormalizationRule(provider, prefix, re.compile(pattern)))
+    return rules
+
+class CodeMatcher:
+    """Active codes with exact, normalized and containment lookups.
+
+    Codes are kept in a set, with a count of codes per length. Containment
+    probes the scan's substrings of every stored code length, so a lookup is
+    a few set probes and stays well under a millisecond. Only a scan that
+    contains exactly one stored code of at least MIN_TOLERANT_MATCH_LENGTH
+    characters matches; a scan shorter than the stored code never does, as a
+    fragment of a code must not open the gate.
+    """
+
+    def __init__(self, codes=()):
+        self._codes = set(codes)
+        self._lengths = Counter(len(code) for code in self._codes)
+
+    def __contains__(self, code):
+        return code in self._codes
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __iter__(self):
+        return iter(self._codes)
+
+    def add(self, code):
+        if code in self._codes:
+            return
+        self._codes.add(code)
+        self._lengths[len(code)] += 1
+
+    def discard(self, code):
+        if code not in self._codes:
+            return
+        self._codes.discard(code)
+        self._lengths[len(code)] -= 1
+        if not self._lengths[len(code)]:
+            del self._lengths[len(code)]
+
+    def match(self, scanned, rules=()):
+        """Return the CodeMatch a scanned barcode resolves to, or None."""
+        scanned = scanned.strip()
+        if scanned in self._codes:
+            return CodeMatch(scanned, "exact")
+        for rule in rules:
+            stripped = scanned[len(rule.prefix):]
+            if scanned.startswith(rule.prefix) and stripped in self._codes and rule.regex.fullmatch(scanned):
+                return CodeMatch(stripped, f"{rule.provider}: without {rule.prefix}")
+        if len(scanned) < MIN_TOLERANT_MATCH_LENGTH:
+            return None
+        return self._contained(scanned)
+
+    def _contained(self, scanned):
+        """A stored code inside a longer label barcode; the longest stored code wins."""
+        for length in sorted((length for length in self._lengths if MIN_TOLERANT_MATCH_LENGTH <= length < len(scanned)), reverse=True):
+            found = {scanned[start:start + length] for start in range(len(scanned) - length + 1)} & self._codes
+            if len(found) == 1:
+                return CodeMatch(found.pop(), "contained")
+            if found:
+                return None
+        return None
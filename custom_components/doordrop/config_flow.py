@@ -1,10 +1,12 @@
 import voluptuous as vol
 from homeassistant import config_entries, exceptions
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
+import homeassistant.helpers.config_validation as cv
+import asyncio
 import logging
 import imaplib
-import mysql.connector
-from .const import DOMAIN, CONF_IMAP_HOST, CONF_IMAP_PORT, CONF_IMAP_USERNAME, CONF_IMAP_PASSWORD, CONF_DB_HOST, CONF_DB_PORT, CONF_DB_USERNAME, CONF_DB_PASSWORD, CONF_DB_NAME, CONF_SCAN_INTERVAL, CONF_MQTT_TOPIC, CONF_MQTT_STATUS_TOPIC, AUTHORIZED_BARCODES
+from .database import ShipmentDatabase
+from .const import DOMAIN, CONF_IMAP_HOST, CONF_IMAP_PORT, CONF_IMAP_USERNAME, CONF_IMAP_PASSWORD, CONF_DB_HOST, CONF_DB_PORT, CONF_DB_USERNAME, CONF_DB_PASSWORD, CONF_DB_NAME, CONF_SCAN_INTERVAL, CONF_MQTT_TOPIC, CONF_MQTT_STATUS_TOPIC, AUTHORIZED_BARCODES, CONF_PARSER_WORKERS, DEFAULT_PARSER_WORKERS, CONF_CODE_EXPIRY_DAYS, DEFAULT_CODE_EXPIRY_DAYS, CONF_RETENTION_DAYS, DEFAULT_RETENTION_DAYS, CONF_IMAP_FOLDERS, CONF_IMAP_SOURCES, DEFAULT_IMAP_FOLDER, VALIDATION_TIMEOUT
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -23,6 +25,7 @@ DATA_SCHEMA = vol.Schema({
     vol.Required(CONF_IMAP_PORT, default=DEFAULT_IMAP_PORT): int,
     vol.Required(CONF_IMAP_USERNAME, default=DEFAULT_IMAP_USERNAME): str,
     vol.Required(CONF_IMAP_PASSWORD): str,
+    vol.Optional(CONF_IMAP_FOLDERS, default=DEFAULT_IMAP_FOLDER): str,
     vol.Required(CONF_DB_HOST, default=DEFAULT_DB_HOST): str,
     vol.Required(CONF_DB_PORT, default=DEFAULT_DB_PORT): int,
     vol.Required(CONF_DB_USERNAME, default=DEFAULT_DB_USERNAME): str,
@@ -32,8 +35,50 @@ DATA_SCHEMA = vol.Schema({
     vol.Required(CONF_MQTT_TOPIC, default=DEFAULT_MQTT_TOPIC): str,
     vol.Required(CONF_MQTT_STATUS_TOPIC, default=DEFAULT_MQTT_STATUS_TOPIC): str,
     vol.Optional(AUTHORIZED_BARCODES, default=""): str,  # Nowa opcja konfiguracji
+    vol.Optional(CONF_PARSER_WORKERS, default=DEFAULT_PARSER_WORKERS): vol.All(vol.Coerce(int), vol.Range(min=1, max=8)),
 })
 
+SOURCE_SCHEMA = vol.Schema({
+    vol.Required(CONF_IMAP_HOST): str,
+    vol.Required(CONF_IMAP_PORT, default=DEFAULT_IMAP_PORT): int,
+    vol.Required(CONF_IMAP_USERNAME): str,
+    vol.Required(CONF_IMAP_PASSWORD): str,
+    vol.Optional(CONF_IMAP_FOLDERS, default=DEFAULT_IMAP_FOLDER): str,
+})
+
+def check_imap_login(host, port, username, password):
+    """Log in to an IMAP server once. Blocking, bounded by VALIDATION_TIMEOUT per socket operation."""
+    server = imaplib.IMAP4_SSL(host, port, timeout=VALIDATION_TIMEOUT)
+    try:
+        server.login(username, password)
+    finally:
+        server.logout()
+
+async def async_check_imap(hass: HomeAssistant, host, port, username, password):
+    """Check IMAP credentials in the executor; raises CannotConnect."""
+    try:
+        async with asyncio.timeout(VALIDATION_TIMEOUT):
+            await hass.async_add_executor_job(check_imap_login, host, port, username, password)
+    except Exception as e:
+        _LOGGER.error(f"IMAP Connection error: {e}")
+        raise CannotConnect("imap_cannot_connect") from e
+
+async def async_check_database(data):
+    """Check the MySQL credentials; raises CannotConnect."""
+    database = ShipmentDatabase(
+        data[CONF_DB_HOST],
+        data[CONF_DB_PORT],
+        data[CONF_DB_USERNAME],
+        data[CONF_DB_PASSWORD],
+        data[CONF_DB_NAME]
+    )
+    try:
+        async with asyncio.timeout(VALIDATION_TIMEOUT):
+            await database.check_connection()
+    except Exception as e:
+        _LOGGER.error(f"MySQL Connection error: {e}")
+        raise CannotConnect("db_cannot_connect") from e
+
 class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Handle a config flow for DoorDrop."""
 
@@ -55,32 +100,85 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
         return self.async_show_form(step_id="user", data_schema=DATA_SCHEMA, errors=errors)
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        return OptionsFlowHandler()
+
     async def validate_input(self, hass: HomeAssistant, data: dict) -> dict[str, str]:
-        """Validate user input."""
-        # IMAP validation
-        try:
-            server = imaplib.IMAP4_SSL(data[CONF_IMAP_HOST], data[CONF_IMAP_PORT])
-            server.login(data[CONF_IMAP_USERNAME], data[CONF_IMAP_PASSWORD])
-            server.logout()
-        except Exception as e:
-            _LOGGER.error(f"IMAP Connection error: {e}")
-            raise CannotConnect("Failed to connect to IMAP server")
-
-        # MySQL validation
-        try:
-            conn = mysql.connector.connect(
-                host=data[CONF_DB_HOST],
-                port=data[CONF_DB_PORT],
-                user=data[CONF_DB_USERNAME],
-                password=data[CONF_DB_PASSWORD],
-                database=data[CONF_DB_NAME]
-            )
-            conn.close()
-        except Exception as e:
-            _LOGGER.error(f"MySQL Connection error: {e}")
-            raise CannotConnect("Failed to connect to MySQL database")
+        """Validate user input, checking IMAP and MySQL at the same time."""
+        results = await asyncio.gather(
+            async_check_imap(hass, data[CONF_IMAP_HOST], data[CONF_IMAP_PORT], data[CONF_IMAP_USERNAME], data[CONF_IMAP_PASSWORD]),
+            async_check_database(data),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
 
         return {"title": "DoorDrop"}
 
+class OptionsFlowHandler(config_entries.OptionsFlow):
+    """Handle DoorDrop options."""
+
+    async def async_step_init(self, user_input=None):
+        menu_options = ["settings", "add_source"]
+        if self.config_entry.options.get(CONF_IMAP_SOURCES):
+            menu_options.append("remove_source")
+        return self.async_show_menu(step_id="init", menu_options=menu_options)
+
+    def _save(self, changes):
+        return self.async_create_entry(title="", data={**self.config_entry.options, **changes})
+
+    async def async_step_settings(self, user_input=None):
+        if user_input is not None:
+            return self._save(user_input)
+
+        options = self.config_entry.options
+        data = self.config_entry.data
+        current = options.get(AUTHORIZED_BARCODES, data.get(AUTHORIZED_BARCODES, ""))
+        folders = options.get(CONF_IMAP_FOLDERS, data.get(CONF_IMAP_FOLDERS, DEFAULT_IMAP_FOLDER))
+        return self.async_show_form(
+            step_id="settings",
+            data_schema=vol.Schema({
+                vol.Optional(CONF_IMAP_FOLDERS, default=folders): str,
+                vol.Optional(AUTHORIZED_BARCODES, default=current): str,
+                vol.Optional(CONF_CODE_EXPIRY_DAYS, default=options.get(CONF_CODE_EXPIRY_DAYS, DEFAULT_CODE_EXPIRY_DAYS)): vol.All(vol.Coerce(int), vol.Range(min=0)),
+                vol.Optional(CONF_RETENTION_DAYS, default=options.get(CONF_RETENTION_DAYS, DEFAULT_RETENTION_DAYS)): vol.All(vol.Coerce(int), vol.Range(min=0)),
+            })
+        )
+
+    async def async_step_add_source(self, user_input=None):
+        """Add another IMAP account, each with its own comma separated folders."""
+        errors = {}
+        if user_input is not None:
+            try:
+                await async_check_imap(
+                    self.hass, user_input[CONF_IMAP_HOST], user_input[CONF_IMAP_PORT],
+                    user_input[CONF_IMAP_USERNAME], user_input[CONF_IMAP_PASSWORD]
+                )
+            except CannotConnect as e:
+                errors["base"] = str(e)
+            else:
+                sources = list(self.config_entry.options.get(CONF_IMAP_SOURCES, []))
+                sources.append(user_input)
+                return self._save({CONF_IMAP_SOURCES: sources})
+
+        return self.async_show_form(step_id="add_source", data_schema=SOURCE_SCHEMA, errors=errors)
+
+    async def async_step_remove_source(self, user_input=None):
+        sources = self.config_entry.options.get(CONF_IMAP_SOURCES, [])
+        labels = [f"{source[CONF_IMAP_USERNAME]}@{source[CONF_IMAP_HOST]}" for source in sources]
+        if user_input is not None:
+            removed = set(user_input["sources"])
+            return self._save({CONF_IMAP_SOURCES: [
+                source for source, label in zip(sources, labels) if label not in removed
+            ]})
+
+        return self.async_show_form(
+            step_id="remove_source",
+            data_schema=vol.Schema({vol.Required("sources", default=[]): cv.multi_select(labels)})
+        )
+
 class CannotConnect(exceptions.HomeAssistantError):
     """Error to indicate we cannot connect."""
@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 DOMAIN = "doordrop"
 
 CONF_IMAP_HOST = "imap_host"
@@ -13,3 +15,57 @@ CONF_SCAN_INTERVAL = "scan_interval"
 CONF_MQTT_TOPIC = "mqtt_topic"
 CONF_MQTT_STATUS_TOPIC = "mqtt_status_topic"
 AUTHORIZED_BARCODES = "authorized_barcodes"
+CONF_IMAP_FOLDERS = "imap_folders"
+CONF_IMAP_SOURCES = "imap_sources"
+DEFAULT_IMAP_FOLDER = "INBOX"
+
+DEFAULT_CODE_RESYNC_INTERVAL = timedelta(minutes=15)
+
+DEFAULT_DB_POOL_SIZE = 5
+DEFAULT_DB_QUERY_TIMEOUT = 3  # seconds for borrowing a connection and running a query
+DB_POOL_RECYCLE = 3600  # seconds before an idle pooled connection is replaced
+DB_BACKOFF_INITIAL = 1  # seconds
+DB_BACKOFF_MAX = 60  # seconds
+DB_SCHEMA_RETRY_INTERVAL = 3600  # seconds before a failed schema migration is tried again
+CODE_MAX_LENGTH = 64  # characters that fit the shipments.code column
+
+IMAP_TIMEOUT = 30  # seconds for IMAP socket operations
+VALIDATION_TIMEOUT = 10  # seconds the config flow waits for the IMAP and database checks
+IMAP_IDLE_CHECK_TIMEOUT = 10  # seconds between stop checks while in IDLE
+IMAP_IDLE_RENEW = 25 * 60  # seconds; RFC 2177 servers may drop an IDLE after 30 minutes
+IMAP_BACKOFF_INITIAL = 5  # seconds
+IMAP_BACKOFF_MAX = 300  # seconds
+IMAP_FETCH_BATCH_SIZE = 50  # messages per IMAP FETCH round trip
+IMAP_MAX_CONCURRENT_FETCHES = 4  # mailbox folders fetching at once; the others keep waiting in IDLE
+PATTERNS_FILE = "doordrop_patterns.yaml"  # optional courier definitions in the config directory
+MAIL_BODY_MAX_BYTES = 128 * 1024  # bytes of each message fetched and parsed; tracking codes sit near the top
+MAIL_CHECKPOINT_SAVE_DELAY = 10  # seconds to coalesce UID checkpoint writes
+
+CONF_PARSER_WORKERS = "parser_workers"
+DEFAULT_PARSER_WORKERS = 1
+PIPELINE_QUEUE_SIZE = 100  # raw messages in flight before the IMAP fetch is paused
+PIPELINE_BATCH_SIZE = 100  # extracted codes handed to the event loop at once
+PIPELINE_FLUSH_DELAY = 1  # seconds to wait for more codes before handing over a partial batch
+METRICS_WINDOW = 500  # latest samples kept per timing for percentiles
+WRITE_BEHIND_BATCH_SIZE = 100  # code deactivations per UPDATE statement
+WRITE_BEHIND_RETRY_INTERVAL = timedelta(seconds=30)
+TOMBSTONE_TTL = DEFAULT_CODE_RESYNC_INTERVAL.total_seconds() * 2  # seconds a flushed code stays blocked
+DEACTIVATION_MISSING_MAX_AGE = timedelta(days=7)  # how long a used code absent from the table stays queued
+
+IMPORT_CHUNK_SIZE = 500  # codes per transaction when importing shipments in bulk
+
+SCAN_RESULT_TTL = 30  # seconds a successful scan is replayed to repeated scans of the same code
+SCAN_MAX_CONCURRENCY = 8  # scans authorized at once across all scanner topics
+SCAN_TOPIC_CONCURRENCY = 2  # scans authorized at once per scanner topic
+MIN_TOLERANT_MATCH_LENGTH = 10  # shortest stored code matched inside a longer scanned barcode
+EVENT_SCAN = "doordrop_scan"  # fired once per scan
+SCAN_LOG_SIZE = 100  # recent scans kept for diagnostics
+SCAN_LOG_ATTRIBUTE_SIZE = 10  # recent scans shown as a sensor attribute
+
+CONF_CODE_EXPIRY_DAYS = "code_expiry_days"
+CONF_RETENTION_DAYS = "retention_days"
+DEFAULT_CODE_EXPIRY_DAYS = 60  # active codes older than this are deactivated; 0 keeps them forever
+DEFAULT_RETENTION_DAYS = 365  # inactive rows older than this are archived; 0 keeps them forever
+RETENTION_CHUNK_SIZE = 500  # rows per expiry/archival statement
+RETENTION_CHUNK_PAUSE = 0.5  # seconds between chunks
+RETENTION_RUN_AT = (3, 30)  # local time of the nightly retention run
@@ -0,0 +1,359 @@
+import asyncio
+import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import NamedTuple
+import aiomysql
+from homeassistant import exceptions
+from .const import (
+    CODE_MAX_LENGTH, DEFAULT_DB_POOL_SIZE, DEFAULT_DB_QUERY_TIMEOUT, DB_BACKOFF_INITIAL, DB_BACKOFF_MAX, DB_POOL_RECYCLE,
+    DB_SCHEMA_RETRY_INTERVAL
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Matches the shipments.code column: ASCII letters and digits, at most CODE_MAX_LENGTH of them
+SHIPMENT_CODE_PATTERN = re.compile(rf"[A-Za-z0-9]{{6,{CODE_MAX_LENGTH}}}")
+# The same rule in SQL; the length check keeps multi-byte characters out of case-insensitive matching
+UNSTORABLE_CODE_CONDITION = "code IS NULL OR CHAR_LENGTH(code) <> LENGTH(code) OR NOT code REGEXP %s"
+REPORTED_ROWS = 20  # rows listed in the log when a migration has to move some
+
+async def _move_unstorable_codes(cursor):
+    """Move and report rows whose code does not fit the compact column of migration 2.
+
+    Codes that do not match SHIPMENT_CODE_PATTERN would make the ALTER fail
+    or could never be stored again. They are copied unchanged to
+    shipments_unstorable before being removed, so nothing is lost.
+    """
+    params = (f"^{SHIPMENT_CODE_PATTERN.pattern}$",)
+    await cursor.execute(f"SELECT code FROM shipments WHERE {UNSTORABLE_CODE_CONDITION}", params)
+    codes = [row[0] for row in await cursor.fetchall()]
+    if not codes:
+        return
+    _LOGGER.warning(
+        "Moving %d shipment codes that do not fit the shipments table to shipments_unstorable: %s",
+        len(codes), ", ".join(str(code) for code in codes[:REPORTED_ROWS]) + (", ..." if len(codes) > REPORTED_ROWS else "")
+    )
+    await cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS shipments_unstorable (
+            id INT PRIMARY KEY,
+            code VARCHAR(255),
+            date TIMESTAMP NULL,
+            active BOOLEAN,
+            checked_date TIMESTAMP NULL,
+            moved_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    # Each statement commits on its own; a retried migration copies the same ids again
+    await cursor.execute(
+        "INSERT IGNORE INTO shipments_unstorable (id, code, date, active, checked_date) "
+        f"SELECT id, code, date, active, checked_date FROM shipments WHERE {UNSTORABLE_CODE_CONDITION}",
+        params
+    )
+    await cursor.execute(f"DELETE FROM shipments WHERE {UNSTORABLE_CODE_CONDITION}", params)
+
+# Each entry upgrades the schema by one version; applied in order and recorded in doordrop_schema.
+# An entry is a SQL statement or a list of statements and coroutine functions taking the cursor.
+SCHEMA_MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS shipments (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        code VARCHAR(255) UNIQUE,
+        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        active BOOLEAN DEFAULT TRUE,
+        checked_date TIMESTAMP NULL
+    )
+    """,
+    # Compact ASCII codes and covering indexes for the active-code resync, expiry and archival
+    [
+        _move_unstorable_codes,
+        """
+        ALTER TABLE shipments
+            MODIFY code VARCHAR(64) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+            MODIFY active BOOLEAN NOT NULL DEFAULT TRUE,
+            ADD INDEX idx_active_code (active, code),
+            ADD INDEX idx_active_date (active, date),
+            ADD INDEX idx_active_checked (active, checked_date)
+        """,
+    ],
+    """
+    CREATE TABLE IF NOT EXISTS shipments_archive (
+        id INT PRIMARY KEY,
+        code VARCHAR(64) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+        date TIMESTAMP NULL,
+        active BOOLEAN NOT NULL,
+        checked_date TIMESTAMP NULL,
+        archived_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+class UpsertResult(NamedTuple):
+    inserted: int
+    duplicates: int
+    active: list
+
+class DatabaseUnavailable(exceptions.HomeAssistantError):
+    """Error to indicate the database cannot be reached."""
+
+class DatabaseTimeout(DatabaseUnavailable):
+    """Error to indicate a query did not finish within the query timeout."""
+
+class ShipmentDatabase:
+    """Pooled asyncio access to the shipments table shared by the whole integration."""
+
+    def __init__(self, host, port, username, password, database, pool_size=DEFAULT_DB_POOL_SIZE, query_timeout=DEFAULT_DB_QUERY_TIMEOUT):
+        self._config = {
+            "host": host,
+            "port": port,
+            "user": username,
+            "password": password,
+            "db": database,
+        }
+        self._pool_size = pool_size
+        self._query_timeout = query_timeout
+        self._pool = None
+        self._lock = asyncio.Lock()
+        self._schema_lock = asyncio.Lock()
+        self._schema_ready = False
+        self._schema_retry_at = 0
+        self._backoff = 0
+        self._retry_at = 0
+
+    async def _get_pool(self):
+        """Create the connection pool on first use, honouring the reconnect backoff."""
+        if self._pool is not None:
+            return self._pool
+        async with self._lock:
+            if self._pool is None:
+                if time.monotonic() < self._retry_at:
+                    raise DatabaseUnavailable("Database connection is backing off")
+                try:
+                    async with asyncio.timeout(self._query_timeout):
+                        self._pool = await aiomysql.create_pool(
+                            minsize=1,
+                            maxsize=self._pool_size,
+                            autocommit=True,
+                            pool_recycle=DB_POOL_RECYCLE,
+                            **self._config
+                        )
+                except Exception as e:
+                    self._mark_failure()
+                    raise DatabaseUnavailable(f"Failed to connect to MySQL database: {e}") from e
+            return self._pool
+
+    def _mark_failure(self):
+        """Push the next connection attempt back exponentially."""
+        self._backoff = min(self._backoff * 2 or DB_BACKOFF_INITIAL, DB_BACKOFF_MAX)
+        self._retry_at = time.monotonic() + self._backoff
+        _LOGGER.warning("Database unavailable, next attempt in %s seconds", self._backoff)
+
+    async def _acquire(self, pool):
+        """Borrow a pooled connection and make sure it is alive."""
+        conn = None
+        try:
+            conn = await pool.acquire()
+            await conn.ping(reconnect=True)
+        except BaseException as e:
+            if conn is not None:
+                conn.close()
+                pool.release(conn)
+            if isinstance(e, (aiomysql.OperationalError, OSError)):
+                self._mark_failure()
+                raise DatabaseUnavailable(f"Failed to connect to MySQL database: {e}") from e
+            raise
+        self._backoff = 0
+        self._retry_at = 0
+        return conn
+
+    @asynccontextmanager
+    async def connection(self):
+        """Borrow a healthy pooled connection for at most the query timeout."""
+        pool = await self._get_pool()
+        if not self._schema_ready:
+            await self._ensure_schema(pool)
+        conn = None
+        try:
+            async with asyncio.timeout(self._query_timeout):
+                conn = await self._acquire(pool)
+                yield conn
+        except BaseException as e:
+            # The connection state is unknown; closing it makes the pool discard it
+            if conn is not None:
+                conn.close()
+            if isinstance(e, TimeoutError):
+                raise DatabaseTimeout("Database query timed out") from e
+            raise
+        finally:
+            if conn is not None:
+                pool.release(conn)
+
+    async def setup(self):
+        """Create or migrate the schema, retrying a migration that failed before."""
+        self._schema_retry_at = 0
+        async with self.connection():
+            pass
+
+    async def close(self):
+        """Close every pooled connection."""
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    async def check_connection(self):
+        """Open a single connection to validate the credentials."""
+        try:
+            async with asyncio.timeout(self._query_timeout):
+                conn = await aiomysql.connect(**self._config)
+        except Exception as e:
+            raise DatabaseUnavailable(f"Failed to connect to MySQL database: {e}") from e
+        conn.close()
+
+    async def _ensure_schema(self, pool):
+        """Apply pending migrations on a connection of their own, without the query timeout.
+
+        A failed migration is logged and tried again after
+        DB_SCHEMA_RETRY_INTERVAL or on the next setup(), not on every query;
+        queries meanwhile run against the schema as it is.
+        """
+        async with self._schema_lock:
+            if self._schema_ready or time.monotonic() < self._schema_retry_at:
+                return
+            try:
+                async with asyncio.timeout(self._query_timeout):
+                    conn = await self._acquire(pool)
+            except TimeoutError as e:
+                raise DatabaseTimeout("Database query timed out") from e
+            try:
+                await self._migrate(conn)
+            except Exception as e:
+                conn.close()
+                self._schema_retry_at = time.monotonic() + DB_SCHEMA_RETRY_INTERVAL
+                _LOGGER.error("Migrating the DoorDrop database schema failed, next attempt in %s seconds: %s", DB_SCHEMA_RETRY_INTERVAL, str(e))
+                return
+            finally:
+                pool.release(conn)
+            self._schema_ready = True
+
+    async def _migrate(self, conn):
+        async with conn.cursor() as cursor:
+            await cursor.execute("CREATE TABLE IF NOT EXISTS doordrop_schema (version INT NOT NULL)")
+            await cursor.execute("SELECT MAX(version) FROM doordrop_schema")
+            version = (await cursor.fetchone())[0] or 0
+            for target, migration in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+                _LOGGER.info("Migrating DoorDrop database schema to version %d", target)
+                for step in migration if isinstance(migration, list) else [migration]:
+                    if callable(step):
+                        await step(cursor)
+                    else:
+                        await cursor.execute(step)
+                await cursor.execute("INSERT INTO doordrop_schema (version) VALUES (%s)", (target,))
+
+    async def is_code_active(self, code):
+        """Return True if the code exists and is active."""
+        async with self.connection() as conn, conn.cursor() as cursor:
+            await cursor.execute("SELECT active FROM shipments WHERE code = %s", (code,))
+            result = await cursor.fetchone()
+            if result is None:
+                _LOGGER.info("Code %s not found in the database.", code)
+                return False
+            return bool(result[0])
+
+    async def fetch_active_codes(self):
+        """Return all active shipment codes."""
+        async with self.connection() as conn, conn.cursor() as cursor:
+            await cursor.execute("SELECT code FROM shipments WHERE active = TRUE")
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def upsert_codes(self, codes, used=()):
+        """Insert codes with one multi-row statement in a single transaction.
+
+        Existing rows keep their state, except that codes listed in used,
+        e.g. buffered codes scanned during an outage, end up inactive. The
+        result lists which of the codes are active afterwards, so callers can
+        update their caches. Codes that do not fit the code column are
+        skipped, so one of them cannot fail the whole batch.
+        """
+        codes = list(dict.fromkeys(codes))
+        unstorable = [code for code in codes if not SHIPMENT_CODE_PATTERN.fullmatch(code)]
+        if unstorable:
+            _LOGGER.warning("Skipping %d codes that do not fit the shipments table: %s", len(unstorable), ", ".join(unstorable[:REPORTED_ROWS]))
+            codes = [code for code in codes if SHIPMENT_CODE_PATTERN.fullmatch(code)]
+        if not codes:
+            return UpsertResult(0, 0, [])
+        values = ", ".join(["(%s)"] * len(codes))
+        in_list = ", ".join(["%s"] * len(codes))
+        async with self.connection() as conn, conn.cursor() as cursor:
+            await conn.begin()
+            await cursor.execute(f"INSERT INTO shipments (code) VALUES {values} ON DUPLICATE KEY UPDATE code=VALUES(code)", codes)
+            # Affected rows count 1 per new row and 0 per unchanged duplicate
+            inserted = cursor.rowcount
+            used = set(used)
+            used = [code for code in codes if code in used]
+            if used:
+                await cursor.execute(
+                    "UPDATE shipments SET active = FALSE, checked_date = COALESCE(checked_date, %s) "
+                    f"WHERE code IN ({', '.join(['%s'] * len(used))})",
+                    [datetime.now(), *used]
+                )
+            await cursor.execute(f"SELECT code FROM shipments WHERE active = TRUE AND code IN ({in_list})", codes)
+            active = [row[0] for row in await cursor.fetchall()]
+            await conn.commit()
+        return UpsertResult(inserted, len(codes) - inserted, active)
+
+    async def deactivate_codes(self, checked_dates):
+        """Mark codes inactive, each with its own checked date; return the codes not in the table."""
+        if not checked_dates:
+            return []
+        cases = " ".join(["WHEN %s THEN %s"] * len(checked_dates))
+        in_list = ", ".join(["%s"] * len(checked_dates))
+        params = [value for item in checked_dates.items() for value in item] + list(checked_dates)
+        async with self.connection() as conn, conn.cursor() as cursor:
+            await cursor.execute(
+                f"UPDATE shipments SET active = FALSE, checked_date = CASE code {cases} END WHERE code IN ({in_list})",
+                params
+            )
+            await cursor.execute(f"SELECT code FROM shipments WHERE code IN ({in_list})", list(checked_dates))
+            found = {row[0] for row in await cursor.fetchall()}
+            return [code for code in checked_dates if code not in found]
+
+    async def expire_stale_codes(self, older_than, limit):
+        """Deactivate up to limit codes active since before older_than; return how many."""
+        async with self.connection() as conn, conn.cursor() as cursor:
+            await cursor.execute(
+                "UPDATE shipments SET active = FALSE WHERE active = TRUE AND date < %s LIMIT %s",
+                (older_than, limit)
+            )
+            return cursor.rowcount
+
+    async def archive_inactive_codes(self, older_than, limit):
+        """Move up to limit inactive rows last used before older_than to shipments_archive; return how many."""
+        async with self.connection() as conn, conn.cursor() as cursor:
+            await conn.begin()
+            await cursor.execute(
+                "SELECT id FROM shipments WHERE active = FALSE "
+                "AND (checked_date < %s OR (checked_date IS NULL AND date < %s)) "
+                "LIMIT %s FOR UPDATE",
+                (older_than, older_than, limit)
+            )
+            ids = [row[0] for row in await cursor.fetchall()]
+            if ids:
+                in_list = ", ".join(["%s"] * len(ids))
+                await cursor.execute(
+                    "INSERT IGNORE INTO shipments_archive (id, code, date, active, checked_date) "
+                    f"SELECT id, code, date, active, checked_date FROM shipments WHERE id IN ({in_list})",
+                    ids
+                )
+                await cursor.execute(f"DELETE FROM shipments WHERE id IN ({in_list})", ids)
+            await conn.commit()
+            return len(ids)
+
+    async def set_code_active(self, code, active):
+        """Update the active flag and checked date of a code."""
+        async with self.connection() as conn, conn.cursor() as cursor:
+            await cursor.execute("UPDATE shipments SET active = %s, checked_date = %s WHERE code = %s", (active, datetime.now(), code))
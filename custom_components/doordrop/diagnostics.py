@@ -0,0 +1,13 @@
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from .const import DOMAIN
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry):
+    """Return metrics, recent scans, the last mail batch and courier pattern statistics for the diagnostics download."""
+    data = hass.data[DOMAIN][entry.entry_id]
+    return {
+        "metrics": data['metrics'].as_dict(),
+        "recent_scans": data['scan_log'].as_list(),
+        "last_mail_batch": data['mail_batches'].data,
+        "patterns": data['patterns'].stats.as_dict(),
+    }
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import time
+from .const import SCAN_RESULT_TTL, SCAN_MAX_CONCURRENCY, SCAN_TOPIC_CONCURRENCY
+
+_LOGGER = logging.getLogger(__name__)
+
+class ScanDispatcher:
+    """Front door for scans in front of the authorize coroutine.
+
+    Concurrent scans of the same code on the same scanner topic share one
+    authorization (single-flight), a successful authorization and the match
+    behind it are replayed to repeated scans on that topic for
+    SCAN_RESULT_TTL seconds, and concurrency is bounded globally and per
+    scanner topic so a burst on one gate cannot starve another. A code used
+    at one gate is never replayed to another; that scan goes through
+    authorize and is refused by the tombstone.
+    """
+
+    def __init__(self, hass, authorize, metrics):
+        """authorize is a coroutine function taking a code and returning its CodeMatch, or None if it is refused."""
+        self.hass = hass
+        self._authorize = authorize
+        self._metrics = metrics
+        self._slots = asyncio.Semaphore(SCAN_MAX_CONCURRENCY)
+        self._topic_slots = {}
+        self._inflight = {}
+        self._authorized = {}
+
+    async def dispatch(self, code, topic):
+        """Return the CodeMatch of an authorized scan, or None."""
+        key = (topic, code)
+        cached = self._cached(key)
+        if cached is not None:
+            self._metrics.increment("scan_cache_hits")
+            return cached
+        task = self._inflight.get(key)
+        if task is None:
+            task = self.hass.async_create_task(self._run(code, topic))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self._metrics.increment("scan_coalesced")
+        # Shielded so one cancelled waiter does not cancel the authorization for the others
+        return await asyncio.shield(task)
+
+    async def _run(self, code, topic):
+        topic_slots = self._topic_slots.get(topic)
+        if topic_slots is None:
+            topic_slots = self._topic_slots[topic] = asyncio.Semaphore(SCAN_TOPIC_CONCURRENCY)
+        async with topic_slots, self._slots:
+            match = await self._authorize(code)
+        if match is not None:
+            self._prune()
+            self._authorized[(topic, code)] = (time.monotonic() + SCAN_RESULT_TTL, match)
+        return match
+
+    def _cached(self, key):
+        expires, match = self._authorized.get(key, (0, None))
+        return match if time.monotonic() < expires else None
+
+    def _prune(self):
+        now = time.monotonic()
+        self._authorized = {key: cached for key, cached in self._authorized.items() if cached[0] > now}
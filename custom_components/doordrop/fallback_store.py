@@ -0,0 +1,106 @@
+import logging
+import sqlite3
+import threading
+from homeassistant.core import HomeAssistant
+
+_LOGGER = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS active_codes (code TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS pending_inserts (code TEXT PRIMARY KEY, queued_at TEXT DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS used_codes (code TEXT PRIMARY KEY);
+"""
+
+class FallbackStore:
+    """Local SQLite mirror that keeps gate authorization working while MariaDB is down.
+
+    Holds the active codes of the last successful resync and the mail codes
+    that could not be written to the shipments table yet. Scan deactivations
+    are buffered by DeactivationQueue; the codes they use up are also
+    recorded here until a mirror no longer lists them, so a restart during
+    an outage cannot make a used code valid again. All methods run in the
+    executor.
+    """
+
+    def __init__(self, hass: HomeAssistant, path):
+        self.hass = hass
+        self._path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _run(self, operation, *args):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                return operation(conn, *args)
+
+    async def async_setup(self):
+        await self.hass.async_add_executor_job(self._run, lambda conn: None)
+
+    async def async_close(self):
+        def close():
+            with self._lock:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+        await self.hass.async_add_executor_job(close)
+
+    async def async_replace_active(self, codes):
+        """Mirror the active codes of a successful resync."""
+        def replace(conn, codes):
+            conn.execute("DELETE FROM active_codes")
+            conn.executemany("INSERT INTO active_codes (code) VALUES (?)", ((code,) for code in codes))
+            # A used code stays excluded while the mirror or the insert buffer still lists it
+            conn.execute(
+                "DELETE FROM used_codes WHERE code NOT IN (SELECT code FROM active_codes UNION SELECT code FROM pending_inserts)"
+            )
+        await self.hass.async_add_executor_job(self._run, replace, list(codes))
+
+    async def async_load_active(self):
+        """Return the mirrored active codes plus the codes still waiting to be inserted, minus used ones."""
+        def load(conn):
+            rows = conn.execute(
+                "SELECT code FROM active_codes UNION SELECT code FROM pending_inserts EXCEPT SELECT code FROM used_codes"
+            ).fetchall()
+            return [row[0] for row in rows]
+        return await self.hass.async_add_executor_job(self._run, load)
+
+    async def async_mark_used(self, codes):
+        """Exclude codes used at the gate from the mirror until a resync confirms them inactive."""
+        def mark(conn, codes):
+            conn.executemany("INSERT OR IGNORE INTO used_codes (code) VALUES (?)", ((code,) for code in codes))
+        await self.hass.async_add_executor_job(self._run, mark, list(codes))
+
+    async def async_unmark_used(self, codes):
+        """Make reactivated codes valid in the mirror again."""
+        def unmark(conn, codes):
+            conn.executemany("DELETE FROM used_codes WHERE code = ?", ((code,) for code in codes))
+        await self.hass.async_add_executor_job(self._run, unmark, list(codes))
+
+    async def async_used_codes(self):
+        """Return the codes marked as used."""
+        def used(conn):
+            return [row[0] for row in conn.execute("SELECT code FROM used_codes").fetchall()]
+        return await self.hass.async_add_executor_job(self._run, used)
+
+    async def async_buffer_inserts(self, codes):
+        def buffer(conn, codes):
+            conn.executemany("INSERT OR IGNORE INTO pending_inserts (code) VALUES (?)", ((code,) for code in codes))
+        await self.hass.async_add_executor_job(self._run, buffer, list(codes))
+
+    async def async_pending_inserts(self):
+        def pending(conn):
+            return [row[0] for row in conn.execute("SELECT code FROM pending_inserts ORDER BY queued_at").fetchall()]
+        return await self.hass.async_add_executor_job(self._run, pending)
+
+    async def async_remove_pending(self, codes):
+        def remove(conn, codes):
+            conn.executemany("DELETE FROM pending_inserts WHERE code = ?", ((code,) for code in codes))
+        await self.hass.async_add_executor_job(self._run, remove, list(codes))
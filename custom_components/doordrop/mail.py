@@ -0,0 +1,261 @@
+import logging
+import threading
+import time
+from typing import NamedTuple
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+from .const import (
+    DOMAIN, CONF_IMAP_HOST, CONF_IMAP_PORT, CONF_IMAP_USERNAME, CONF_IMAP_PASSWORD, CONF_IMAP_FOLDERS,
+    CONF_IMAP_SOURCES, DEFAULT_IMAP_FOLDER, IMAP_TIMEOUT, IMAP_IDLE_CHECK_TIMEOUT, IMAP_IDLE_RENEW, IMAP_BACKOFF_INITIAL, IMAP_BACKOFF_MAX,
+    IMAP_FETCH_BATCH_SIZE, MAIL_CHECKPOINT_SAVE_DELAY, MAIL_BODY_MAX_BYTES
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+HEADER_SECTION = b"BODY[HEADER.FIELDS (SUBJECT)]"
+MAIL_CHECKPOINT_VERSION = 1
+
+class ImapSource(NamedTuple):
+    host: str
+    port: int
+    username: str
+    password: str
+    folders: tuple
+
+def parse_folders(text):
+    """Split a comma separated folder list; an empty list means the inbox."""
+    return tuple(folder.strip() for folder in (text or "").split(",") if folder.strip()) or (DEFAULT_IMAP_FOLDER,)
+
+def mail_sources(data, options):
+    """Return the entry's IMAP account followed by the accounts added in the options."""
+    sources = [ImapSource(
+        data[CONF_IMAP_HOST], data[CONF_IMAP_PORT], data[CONF_IMAP_USERNAME], data[CONF_IMAP_PASSWORD],
+        parse_folders(options.get(CONF_IMAP_FOLDERS, data.get(CONF_IMAP_FOLDERS)))
+    )]
+    for source in options.get(CONF_IMAP_SOURCES, []):
+        sources.append(ImapSource(
+            source[CONF_IMAP_HOST], source[CONF_IMAP_PORT], source[CONF_IMAP_USERNAME], source[CONF_IMAP_PASSWORD],
+            parse_folders(source.get(CONF_IMAP_FOLDERS))
+        ))
+    return sources
+
+class UidCheckpoint:
+    """Persisted last-processed UID per mailbox folder, scoped to its UIDVALIDITY."""
+
+    def __init__(self, hass: HomeAssistant, entry_id):
+        self.hass = hass
+        self._store = Store(hass, MAIL_CHECKPOINT_VERSION, f"{DOMAIN}.{entry_id}.mail")
+        self._data = {}
+        # Watchers of several folders update the same checkpoint from their own threads
+        self._lock = threading.Lock()
+
+    async def async_load(self):
+        self._data = await self._store.async_load() or {}
+
+    def get(self, key, uidvalidity):
+        """Return the last processed UID, or None if unknown or the folder was rebuilt."""
+        entry = self._data.get(key)
+        if entry is None or entry["uidvalidity"] != uidvalidity:
+            return None
+        return entry["uid"]
+
+    def update(self, key, uidvalidity, uid):
+        """Record progress; safe to call from the watcher threads."""
+        with self._lock:
+            self._data = {**self._data, key: {"uidvalidity": uidvalidity, "uid": uid}}
+        self.hass.loop.call_soon_threadsafe(self._store.async_delay_save, lambda: self._data, MAIL_CHECKPOINT_SAVE_DELAY)
+
+def _is_attachment(structure):
+    return any(
+        isinstance(field, tuple) and field and isinstance(field[0], bytes) and field[0].lower() == b"attachment"
+        for field in structure[7:]
+    )
+
+def _find_text_part(structure, subtype=b"plain", prefix=""):
+    """Return (section, subtype, charset, encoding) of the first inline text/<subtype> part in a BODYSTRUCTURE."""
+    if structure.is_multipart:
+        for index, part in enumerate(structure[0], start=1):
+            found = _find_text_part(part, subtype, f"{prefix}{index}.")
+            if found:
+                return found
+        return None
+    if structure[0].lower() != b"text" or structure[1].lower() != subtype or _is_attachment(structure):
+        return None
+    params = structure[2] or ()
+    charset = None
+    for name, value in zip(params[::2], params[1::2]):
+        if name.lower() == b"charset":
+            charset = value
+    return prefix.rstrip(".") or "1", subtype, charset, structure[5] or b"7bit"
+
+def _build_message(header, subtype, charset, encoding, body):
+    """Rebuild a minimal single-part RFC822 message from the fetched header and text part."""
+    content_type = b"text/" + subtype
+    if charset:
+        content_type += b"; charset=" + charset
+    return (
+        header.rstrip(b"\r\n")
+        + b"\r\nContent-Type: " + content_type
+        + b"\r\nContent-Transfer-Encoding: " + encoding
+        + b"\r\n\r\n" + body
+    )
+
+class MailWatcher:
+    """Long-lived IMAP connection that hands new mail over as soon as it arrives.
+
+    Uses IDLE (RFC 2177) when the server supports it and falls back to polling
+    every poll_interval seconds otherwise. Runs in its own thread so it never
+    holds a slot in Home Assistant's executor. Each watched folder has its own
+    watcher, connection and backoff, so a slow or broken account only delays
+    itself.
+    """
+
+    def __init__(self, hass: HomeAssistant, host, port, username, password, poll_interval, on_messages, checkpoint, metrics, folder=DEFAULT_IMAP_FOLDER, fetch_slots=None):
+        """on_messages is called from the watcher thread with a list of raw RFC822 messages.
+
+        fetch_slots is an optional semaphore shared by watchers to bound how
+        many of them fetch at the same time.
+        """
+        self.hass = hass
+        self._host = host
+        self._port = port
+        self._username = username
+        self._password = password
+        self._poll_interval = poll_interval
+        self._on_messages = on_messages
+        self._checkpoint = checkpoint
+        self._metrics = metrics
+        self._checkpoint_key = f"{username}@{host}/{folder}"
+        self._folder = folder
+        self._fetch_slots = fetch_slots
+        self._uidvalidity = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watching the mailbox in a background thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=f"doordrop_imap_{self._username}_{self._folder}", daemon=True)
+        self._thread.start()
+
+    async def async_stop(self):
+        """Stop watching and wait for the connection to be closed."""
+        self._stop_event.set()
+        if self._thread is not None:
+            await self.hass.async_add_executor_job(self._thread.join, IMAP_IDLE_CHECK_TIMEOUT + IMAP_TIMEOUT)
+            self._thread = None
+
+    def _run(self):
+        backoff = 0
+        while not self._stop_event.is_set():
+            client = None
+            try:
+                with self._metrics.timer("mail_connect"):
+                    client = self._connect()
+                backoff = 0
+                if client.has_capability("IDLE"):
+                    _LOGGER.debug("IMAP server supports IDLE, watching %s for new mail", self._folder)
+                    self._watch_idle(client)
+                else:
+                    _LOGGER.info("IMAP server does not support IDLE, polling every %s seconds", self._poll_interval)
+                    self._watch_poll(client)
+            except Exception as e:
+                self._metrics.increment("mail_errors")
+                backoff = min(backoff * 2 or IMAP_BACKOFF_INITIAL, IMAP_BACKOFF_MAX)
+                _LOGGER.error(
+                    "Error in email fetching or processing for %s: %s, reconnecting in %s seconds",
+                    self._checkpoint_key, str(e), backoff
+                )
+                self._stop_event.wait(backoff)
+            finally:
+                if client is not None:
+                    self._disconnect(client)
+
+    def _connect(self):
+        # Imported here, in the watcher thread, to keep it out of Home Assistant's startup
+        from imapclient import IMAPClient
+        client = IMAPClient(self._host, port=self._port, ssl=True, timeout=IMAP_TIMEOUT)
+        client.login(self._username, self._password)
+        folder_info = client.select_folder(self._folder, readonly=True)
+        self._uidvalidity = folder_info[b"UIDVALIDITY"]
+        return client
+
+    def _disconnect(self, client):
+        try:
+            client.logout()
+        except Exception as e:
+            _LOGGER.debug("Error closing IMAP connection: %s", str(e))
+
+    def _watch_idle(self, client):
+        while not self._stop_event.is_set():
+            self._fetch_new(client)
+            client.idle()
+            try:
+                # Servers may drop an IDLE after 30 minutes, so it is renewed periodically
+                renew_at = time.monotonic() + IMAP_IDLE_RENEW
+                while not self._stop_event.is_set() and time.monotonic() < renew_at:
+                    responses = client.idle_check(timeout=IMAP_IDLE_CHECK_TIMEOUT)
+                    if any(len(response) > 1 and response[1] == b"EXISTS" for response in responses):
+                        break
+            finally:
+                client.idle_done()
+
+    def _watch_poll(self, client):
+        while not self._stop_event.is_set():
+            self._fetch_new(client)
+            self._stop_event.wait(self._poll_interval)
+            client.noop()
+
+    def _fetch_new(self, client):
+        """Fetch mail past the UID checkpoint (or unseen mail on first run) in batches."""
+        last_uid = self._checkpoint.get(self._checkpoint_key, self._uidvalidity)
+        newest_uid = None
+        if last_uid is None:
+            # Taken first, so mail arriving in between is unseen and fetched rather than skipped
+            newest_uid = max(client.search(["ALL"]) or [0])
+            uids = client.search(["UNSEEN"])
+        else:
+            # "n:*" always matches the newest message, even when its UID is below n
+            uids = [uid for uid in client.search(["UID", f"{last_uid + 1}:*"]) if uid > last_uid]
+        uids.sort()
+        if uids:
+            _LOGGER.debug("Fetching %d new messages", len(uids))
+        for start in range(0, len(uids), IMAP_FETCH_BATCH_SIZE):
+            batch = uids[start:start + IMAP_FETCH_BATCH_SIZE]
+            if self._fetch_slots is not None:
+                self._fetch_slots.acquire()
+            try:
+                with self._metrics.timer("mail_fetch"):
+                    messages = self._fetch_batch(client, batch)
+            finally:
+                if self._fetch_slots is not None:
+                    self._fetch_slots.release()
+            self._metrics.increment("mail_messages", len(messages))
+            self._on_messages(messages)
+            self._checkpoint.update(self._checkpoint_key, self._uidvalidity, batch[-1])
+        if newest_uid is not None:
+            self._checkpoint.update(self._checkpoint_key, self._uidvalidity, max([newest_uid, *uids]))
+
+    def _fetch_batch(self, client, uids):
+        """Fetch only the subject header and the start of the text part of each message.
+
+        The text/plain part is preferred; HTML-only mail falls back to its
+        text/html part. At most MAIL_BODY_MAX_BYTES of the part are fetched.
+        """
+        overview = client.fetch(uids, ["BODYSTRUCTURE", "BODY.PEEK[HEADER.FIELDS (SUBJECT)]"])
+        parts_by_section = {}
+        for uid, data in overview.items():
+            structure = data[b"BODYSTRUCTURE"]
+            part = _find_text_part(structure) or _find_text_part(structure, b"html")
+            if part is not None:
+                parts_by_section.setdefault(part[0], []).append((uid, part))
+
+        messages = []
+        for section, entries in parts_by_section.items():
+            bodies = client.fetch([uid for uid, _ in entries], [f"BODY.PEEK[{section}]<0.{MAIL_BODY_MAX_BYTES}>"])
+            key = f"BODY[{section}]<0>".encode()
+            for uid, (_, subtype, charset, encoding) in entries:
+                body = bodies.get(uid, {}).get(key)
+                if body is not None:
+                    messages.append(_build_message(overview[uid].get(HEADER_SECTION, b""), subtype, charset, encoding, body))
+        return messages
@@ -0,0 +1,109 @@
+import codecs
+from email.feedparser import BytesFeedParser
+from email.header import decode_header, make_header
+from html.parser import HTMLParser
+from .const import MAIL_BODY_MAX_BYTES
+
+FEED_CHUNK_SIZE = 16 * 1024
+DEFAULT_CHARSET = "utf-8"
+
+# Tags that end a line of text when rendered, so codes in adjacent cells stay separate tokens
+BLOCK_TAGS = {
+    "br", "p", "div", "tr", "td", "th", "li", "table", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "blockquote",
+}
+SKIPPED_TAGS = {"script", "style", "head", "title"}
+
+class _HtmlText(HTMLParser):
+    """Collect the visible text of an HTML document, plus link targets."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.chunks.append("\n")
+        elif tag == "a":
+            # Courier domains and codes often appear only in the tracking link
+            href = dict(attrs).get("href")
+            if href:
+                self.chunks.append(f" {href} ")
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.chunks.append(data)
+
+def html_to_text(html):
+    """Render HTML as plain text: visible text and link targets, one line per block element."""
+    parser = _HtmlText()
+    parser.feed(html)
+    parser.close()
+    lines = (" ".join(line.split()) for line in "".join(parser.chunks).splitlines())
+    return "\n".join(line for line in lines if line)
+
+def parse_message(raw_message, max_bytes=MAIL_BODY_MAX_BYTES):
+    """Parse at most max_bytes of a raw RFC822 message with the incremental feed parser.
+
+    Anything past the budget is never parsed; a part cut off by it is kept
+    as far as it got.
+    """
+    parser = BytesFeedParser()
+    view = memoryview(raw_message)[:max_bytes]
+    for start in range(0, len(view), FEED_CHUNK_SIZE):
+        parser.feed(view[start:start + FEED_CHUNK_SIZE].tobytes())
+    return parser.close()
+
+def message_subject(msg):
+    """Return the decoded subject, or an empty string."""
+    subject = msg["subject"]
+    if not subject:
+        return ""
+    try:
+        return str(make_header(decode_header(subject)))
+    except (LookupError, UnicodeError, ValueError):
+        return str(subject)
+
+def _is_inline(part):
+    return "attachment" not in str(part.get("Content-Disposition", "")).lower()
+
+def _decode_part(part):
+    payload = part.get_payload(decode=True)
+    if payload is None:
+        return None
+    charset = part.get_content_charset() or DEFAULT_CHARSET
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = DEFAULT_CHARSET
+    return payload.decode(charset, errors="replace")
+
+def message_text(msg, max_chars=MAIL_BODY_MAX_BYTES):
+    """Return the first inline text/plain part, else the first text/html part rendered as text.
+
+    Parts are decoded with their declared charset. The result is capped at
+    max_chars characters. Returns None if the message has no text part.
+    """
+    html_part = None
+    for part in msg.walk():
+        if part.is_multipart() or not _is_inline(part):
+            continue
+        content_type = part.get_content_type()
+        if content_type == "text/plain":
+            text = _decode_part(part)
+            if text is not None:
+                return text[:max_chars]
+        elif content_type == "text/html" and html_part is None:
+            html_part = part
+    if html_part is None:
+        return None
+    html = _decode_part(html_part)
+    return html_to_text(html[:max_chars]) if html is not None else None
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from .const import METRICS_WINDOW
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+class LatencyWindow:
+    """Rolling window of durations (seconds) plus lifetime count and sum."""
+
+    def __init__(self, size=METRICS_WINDOW):
+        self._samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self):
+        """Return {quantile: seconds} over the window using the nearest-rank method."""
+        samples = sorted(self._samples)
+        if not samples:
+            return {}
+        return {q: samples[min(len(samples) - 1, int(q * len(samples)))] for q in QUANTILES}
+
+class Metrics:
+    """Timings and counters for the scan and mail paths; safe to use from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._counters = Counter()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            window = self._timings.get(name)
+            if window is None:
+                window = self._timings[name] = LatencyWindow()
+            window.observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """Record the duration of the enclosed block under name, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "timings": {
+                    name: {
+                        "count": window.count,
+                        "sum": window.total,
+                        **{f"p{int(q * 100)}": seconds for q, seconds in window.quantiles().items()},
+                    }
+                    for name, window in self._timings.items()
+                },
+            }
+
+    def prometheus_text(self, labels=""):
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                lines.append(f"# TYPE doordrop_{name}_total counter")
+                lines.append(f"doordrop_{name}_total{{{labels}}} {value}")
+            for name, window in sorted(self._timings.items()):
+                metric = f"doordrop_{name}_seconds"
+                separator = "," if labels else ""
+                lines.append(f"# TYPE {metric} summary")
+                for q, seconds in window.quantiles().items():
+                    lines.append(f'{metric}{{{labels}{separator}quantile="{q}"}} {seconds:.6f}')
+                lines.append(f"{metric}_count{{{labels}}} {window.count}")
+                lines.append(f"{metric}_sum{{{labels}}} {window.total:.6f}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,73 @@
+import time
+from typing import NamedTuple, Optional
+from .const import MAIL_BODY_MAX_BYTES
+from .mail_body import parse_message, message_subject, message_text
+from .pattern_registry import build_courier_patterns
+from .search_patterns import ProviderClassifier, TrackingCodeExtractor, TrackingCandidate
+
+class ParseResult(NamedTuple):
+    subject: str
+    providers: list
+    candidate: Optional[TrackingCandidate]
+    parse_seconds: float
+    extract_seconds: float
+    pattern_version: Optional[str] = None
+    pattern_stats: Optional[dict] = None
+
+class MessageParser:
+    """Turn a raw RFC822 message into its best tracking code candidate.
+
+    Holds no Home Assistant state so it can run in worker processes; the
+    worker processes still import the package, see init_worker().
+    """
+
+    def __init__(self, courier_patterns=None, max_bytes=MAIL_BODY_MAX_BYTES, collect_stats=False):
+        """courier_patterns defaults to the built-in couriers.
+
+        max_bytes bounds both the raw message bytes parsed and the body text
+        searched. With collect_stats, every result carries per-pattern hits and time.
+        """
+        courier_patterns = courier_patterns or build_courier_patterns()
+        self._version = courier_patterns.version
+        self._max_bytes = max_bytes
+        self._collect_stats = collect_stats
+        self._classifier = ProviderClassifier(courier_patterns.provider_patterns)
+        self._extractor = TrackingCodeExtractor(
+            courier_patterns.patterns, courier_patterns.provider_patterns, courier_patterns.labels
+        )
+
+    def parse(self, raw_message):
+        start = time.perf_counter()
+        msg = parse_message(raw_message, self._max_bytes)
+        subject = message_subject(msg)
+        body = self.get_email_body(msg)
+        parsed = time.perf_counter()
+        if not body:
+            return ParseResult(subject, [], None, parsed - start, 0.0, self._version)
+        stats = {} if self._collect_stats else None
+        providers = self._classifier.identify(subject, body, stats)
+        candidates = self._extractor.extract(body, providers, stats)
+        extracted = time.perf_counter()
+        return ParseResult(
+            subject, providers, candidates[0] if candidates else None, parsed - start, extracted - parsed,
+            self._version, stats
+        )
+
+    def get_email_body(self, msg):
+        """Extract the body from the email message, rendering HTML-only mail as text."""
+        return message_text(msg, self._max_bytes)
+
+_worker_parser = None
+
+def init_worker(courier_patterns=None):
+    """Build the parser of a worker process.
+
+    Spawned workers import this module through the integration package, so
+    each one also loads the package's Home Assistant imports once.
+    """
+    global _worker_parser
+    _worker_parser = MessageParser(courier_patterns, collect_stats=True)
+
+def parse_in_worker(raw_message):
+    """Entry point for worker processes; compiles the patterns once per process."""
+    return _worker_parser.parse(raw_message)
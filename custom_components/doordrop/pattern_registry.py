@@ -0,0 +1,172 @@
+import hashlib
+import json
+import re
+import threading
+from re import _constants as sre_constants, _parser as sre_parse
+from typing import NamedTuple
+from .const import CODE_MAX_LENGTH
+from .patterns import PATTERNS, CUSTOM_PATTERNS, TRACKING_LABELS
+from .search_patterns import TOKEN_MIN_LENGTH
+
+class CourierPatterns(NamedTuple):
+    """A validated, immutable set of courier definitions; picklable for the parser workers."""
+    patterns: dict  # provider -> tracking code regexes
+    provider_patterns: dict  # provider -> keyword regexes identifying the provider
+    labels: list
+    version: str
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+def _check_patterns(provider, kind, patterns):
+    for pattern in patterns:
+        if not isinstance(pattern, str) or not pattern:
+            raise ValueError(f"{provider}: {kind} patterns must be non-empty strings, got {pattern!r}")
+        try:
+            regex = re.compile(pattern)
+        except re.error as e:
+            raise ValueError(f"{provider}: invalid {kind} pattern {pattern!r}: {e}") from e
+        if kind == "code" and regex.fullmatch(""):
+            raise ValueError(f"{provider}: code pattern {pattern!r} matches an empty string")
+        if kind == "code" and (problem := _token_problem(pattern)):
+            raise ValueError(f"{provider}: code pattern {pattern!r} can never match a code: {problem}")
+
+def _token_problem(pattern):
+    """Return why the extractor can never match a code pattern, or None.
+
+    The extractor only fullmatches whole tokens of TOKEN_MIN_LENGTH to
+    CODE_MAX_LENGTH ASCII letters and digits.
+    """
+    parsed = sre_parse.parse(pattern)
+    shortest, longest = parsed.getwidth()
+    if longest < TOKEN_MIN_LENGTH:
+        return f"it matches at most {longest} characters, codes have at least {TOKEN_MIN_LENGTH}"
+    if shortest > CODE_MAX_LENGTH:
+        return f"it matches at least {shortest} characters, codes have at most {CODE_MAX_LENGTH}"
+    for char in _required_literals(parsed):
+        if not (char.isascii() and char.isalnum()):
+            return f"it requires {char!r}, codes only contain ASCII letters and digits"
+    return None
+
+def _required_literals(items):
+    """Yield the literal characters every match of a parsed pattern must contain."""
+    for op, value in items:
+        if op is sre_constants.LITERAL:
+            yield chr(value)
+        elif op is sre_constants.SUBPATTERN:
+            yield from _required_literals(value[-1])
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and value[0] > 0:
+            yield from _required_literals(value[2])
+        elif op is sre_constants.IN and all(member_op is sre_constants.LITERAL for member_op, _ in value):
+            # A class of literals only is required as a whole, e.g. [- ]
+            chars = [chr(member) for _, member in value]
+            if not any(char.isascii() and char.isalnum() for char in chars):
+                yield chars[0]
+
+def build_courier_patterns(definitions=None):
+    """Merge user courier definitions over the built-in tables and validate every regex.
+
+    definitions looks like {"couriers": {"GLS": {"codes": [...], "keywords": [...]}}, "labels": [...]}.
+    A courier with the name of a built-in one replaces it; "enabled: false"
+    removes it. Raises ValueError naming the offending courier and pattern.
+    """
+    definitions = definitions or {}
+    if not isinstance(definitions, dict):
+        raise ValueError("Courier definitions must be a mapping")
+    patterns = {provider: _as_list(entries) for provider, entries in PATTERNS.items()}
+    provider_patterns = {provider: _as_list(entries) for provider, entries in CUSTOM_PATTERNS.items()}
+    labels = list(TRACKING_LABELS)
+
+    couriers = definitions.get("couriers") or {}
+    if not isinstance(couriers, dict):
+        raise ValueError("'couriers' must map courier names to their definitions")
+    for provider, courier in couriers.items():
+        if not isinstance(courier, dict):
+            raise ValueError(f"{provider}: definition must be a mapping with 'codes' and 'keywords'")
+        if not courier.get("enabled", True):
+            patterns.pop(provider, None)
+            provider_patterns.pop(provider, None)
+            continue
+        codes = _as_list(courier.get("codes") or [])
+        keywords = _as_list(courier.get("keywords") or [])
+        if not codes:
+            raise ValueError(f"{provider}: at least one code pattern is required")
+        _check_patterns(provider, "code", codes)
+        _check_patterns(provider, "keyword", keywords)
+        patterns[provider] = codes
+        provider_patterns[provider] = keywords
+    if "labels" in definitions:
+        labels = _as_list(definitions["labels"] or [])
+        _check_patterns("labels", "label", labels)
+
+    digest = hashlib.sha1(json.dumps([patterns, provider_patterns, labels], sort_keys=True).encode()).hexdigest()
+    return CourierPatterns(patterns, provider_patterns, labels, digest[:12])
+
+class PatternStats:
+    """Match counts and time spent per pattern, summed over every parsed message."""
+
+    def __init__(self, courier_patterns):
+        self._lock = threading.Lock()
+        self._version = courier_patterns.version
+        # Every pattern is listed from the start so patterns that never match show up too
+        self._stats = {
+            **{f"{provider}: {pattern}": [0, 0.0] for provider, entries in courier_patterns.patterns.items() for pattern in entries},
+            **{f"{provider} keywords": [0, 0.0] for provider in courier_patterns.provider_patterns},
+        }
+        self._messages = 0
+
+    def record(self, version, stats):
+        """Add the per-message {key: (hits, seconds)} of a parse made with the given pattern version."""
+        if version != self._version:
+            return
+        with self._lock:
+            self._messages += 1
+            for key, (hits, seconds) in stats.items():
+                entry = self._stats.setdefault(key, [0, 0.0])
+                entry[0] += hits
+                entry[1] += seconds
+
+    def as_dict(self):
+        """Return the statistics, slowest pattern first."""
+        with self._lock:
+            rows = sorted(self._stats.items(), key=lambda item: -item[1][1])
+            return {
+                "version": self._version,
+                "messages": self._messages,
+                "patterns": {key: {"hits": hits, "ms": round(seconds * 1000, 3)} for key, (hits, seconds) in rows},
+            }
+
+class PatternRegistry:
+    """Holds the active courier patterns and swaps them in one step on reload.
+
+    Listeners are called with the new CourierPatterns after every swap;
+    statistics start over with each version.
+    """
+
+    def __init__(self, courier_patterns=None):
+        self._current = courier_patterns or build_courier_patterns()
+        self._stats = PatternStats(self._current)
+        self._listeners = []
+
+    @property
+    def current(self):
+        return self._current
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def swap(self, courier_patterns):
+        """Make courier_patterns the active set; returns False if nothing changed."""
+        if courier_patterns.version == self._current.version:
+            return False
+        self._current = courier_patterns
+        self._stats = PatternStats(courier_patterns)
+        for listener in list(self._listeners):
+            listener(courier_patterns)
+        return True
+
+    def add_listener(self, listener):
+        """Call listener(courier_patterns) after every swap; returns a function removing it."""
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
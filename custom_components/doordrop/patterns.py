@@ -47,3 +47,9 @@ CUSTOM_PATTERNS = {
         r'\bfedex\b', r'\.fedex\.', r'\bfedex\b.*@', r'fedex.com', r'\bFedex\b', r'<b>.*Fedex.*<'
     ]
 }
+
+# Etykiety, które zwykle poprzedzają numer przesyłki w treści maila
+TRACKING_LABELS = [
+    r'numer\w*\s+(?:przesyłki|paczki|nadania)', r'nr\.?\s+(?:przesyłki|paczki|nadania)',
+    r'tracking\s+(?:number|no)', r'śledź', r'śledzeni\w*', r'list\w*\s+przewozow\w*'
+]
@@ -0,0 +1,134 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+from .const import DEFAULT_PARSER_WORKERS, PIPELINE_QUEUE_SIZE, PIPELINE_BATCH_SIZE, PIPELINE_FLUSH_DELAY
+from .parser import init_worker, parse_in_worker
+
+_LOGGER = logging.getLogger(__name__)
+
+class MailPipeline:
+    """Parse raw messages in worker processes and hand extracted codes back in batches.
+
+    submit() is called from the mail watcher thread and blocks once
+    PIPELINE_QUEUE_SIZE messages are in flight, which slows the IMAP fetch
+    down to the speed of the workers. Codes are delivered to on_codes on the
+    event loop, at most PIPELINE_BATCH_SIZE at a time. When the pattern
+    registry swaps its patterns, new messages go to a fresh pool of workers
+    while the old pool finishes the messages it already has. Stopping also
+    finishes every queued message, since the mail watchers have already
+    advanced their UID checkpoints past it.
+    """
+
+    def __init__(self, hass: HomeAssistant, on_codes, metrics, registry, workers=DEFAULT_PARSER_WORKERS):
+        """on_codes is a coroutine function called with a list of TrackingCandidate."""
+        self.hass = hass
+        self._metrics = metrics
+        self._registry = registry
+        self._unsub_registry = None
+        self._on_codes = on_codes
+        self._workers = workers
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(PIPELINE_QUEUE_SIZE)
+        self._pending = []
+        self._unsub_flush = None
+
+    def start(self):
+        self._executor = self._create_executor(self._registry.current)
+        self._unsub_registry = self._registry.add_listener(self._reload)
+
+    def _create_executor(self, courier_patterns):
+        # Workers are spawned rather than forked; forking the Home Assistant process is unsafe.
+        # Unpickling parse_in_worker imports the integration package, so each worker loads
+        # Home Assistant core once at startup; keep CONF_PARSER_WORKERS small.
+        return ProcessPoolExecutor(
+            max_workers=self._workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(courier_patterns,)
+        )
+
+    @callback
+    def _reload(self, courier_patterns):
+        if self._executor is None:
+            return
+        executor, self._executor = self._executor, self._create_executor(courier_patterns)
+        _LOGGER.info("Courier patterns reloaded (version %s)", courier_patterns.version)
+        self.hass.async_add_executor_job(executor.shutdown, True)
+
+    async def async_stop(self):
+        if self._unsub_registry is not None:
+            self._unsub_registry()
+            self._unsub_registry = None
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            # Drained rather than cancelled: the queued messages are past the UID checkpoint
+            await self.hass.async_add_executor_job(executor.shutdown, True)
+        if self._unsub_flush is not None:
+            self._unsub_flush()
+            self._unsub_flush = None
+        candidates, self._pending = self._pending, []
+        if candidates:
+            await self._on_codes(candidates)
+
+    def submit(self, raw_message):
+        """Queue a message for parsing, waiting while the queue is full."""
+        self._slots.acquire()
+        while True:
+            executor = self._executor
+            if executor is None:
+                self._slots.release()
+                _LOGGER.warning("Mail pipeline is stopped, dropping a message")
+                return
+            try:
+                future = executor.submit(parse_in_worker, raw_message)
+                break
+            except RuntimeError:
+                # The pool is shutting down; after a pattern reload the new pool takes the message
+                if self._executor is executor:
+                    self._slots.release()
+                    _LOGGER.warning("Mail pipeline is stopping, dropping a message")
+                    return
+        future.add_done_callback(self._on_parsed)
+
+    def _on_parsed(self, future):
+        self._slots.release()
+        if future.cancelled():
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            _LOGGER.error("Error processing email: %s", str(e))
+            self._metrics.increment("mail_parse_errors")
+            return
+        self._metrics.observe("mail_parse", result.parse_seconds)
+        self._metrics.observe("mail_extract", result.extract_seconds)
+        if result.pattern_stats:
+            self._registry.stats.record(result.pattern_version, result.pattern_stats)
+        if result.candidate is not None:
+            self._metrics.increment("mail_codes")
+            candidate = result.candidate
+            _LOGGER.info("Found tracking code for %s: %s (score %.1f)", candidate.provider, candidate.code, candidate.score)
+            self.hass.loop.call_soon_threadsafe(self._add_candidate, candidate)
+        elif result.providers:
+            _LOGGER.warning("No tracking code found for providers %s in '%s'", result.providers, result.subject)
+
+    @callback
+    def _add_candidate(self, candidate):
+        self._pending.append(candidate)
+        if len(self._pending) >= PIPELINE_BATCH_SIZE:
+            self._flush()
+        elif self._unsub_flush is None:
+            self._unsub_flush = async_call_later(self.hass, PIPELINE_FLUSH_DELAY, self._flush)
+
+    @callback
+    def _flush(self, now=None):
+        if self._unsub_flush is not None:
+            self._unsub_flush()
+            self._unsub_flush = None
+        if not self._pending:
+            return
+        candidates, self._pending = self._pending, []
+        self.hass.async_create_task(self._on_codes(candidates))
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.event import async_track_time_change
+from .const import (
+    CONF_CODE_EXPIRY_DAYS, CONF_RETENTION_DAYS, DEFAULT_CODE_EXPIRY_DAYS, DEFAULT_RETENTION_DAYS,
+    RETENTION_CHUNK_SIZE, RETENTION_CHUNK_PAUSE, RETENTION_RUN_AT
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+class RetentionPolicy:
+    """Nightly expiry of stale active codes and archival of old inactive rows.
+
+    Both run in chunks of RETENTION_CHUNK_SIZE rows, each its own short
+    statement or transaction, with a pause in between so row locks are never
+    held long enough to delay a scan. Ages come from the entry options and
+    0 disables a step.
+    """
+
+    def __init__(self, hass: HomeAssistant, entry: ConfigEntry, database, on_expired):
+        """on_expired is a coroutine function called after codes were expired."""
+        self.hass = hass
+        self._entry = entry
+        self._database = database
+        self._on_expired = on_expired
+        self._unsub = None
+
+    def async_start(self):
+        hour, minute = RETENTION_RUN_AT
+        self._unsub = async_track_time_change(self.hass, self.async_run, hour=hour, minute=minute, second=0)
+
+    def async_stop(self):
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
+
+    async def async_run(self, now=None):
+        expiry_days = self._entry.options.get(CONF_CODE_EXPIRY_DAYS, DEFAULT_CODE_EXPIRY_DAYS)
+        retention_days = self._entry.options.get(CONF_RETENTION_DAYS, DEFAULT_RETENTION_DAYS)
+        try:
+            if expiry_days:
+                expired = await self._in_chunks(self._database.expire_stale_codes, expiry_days)
+                if expired:
+                    _LOGGER.info("Expired %d codes not used within %d days", expired, expiry_days)
+                    await self._on_expired()
+            if retention_days:
+                archived = await self._in_chunks(self._database.archive_inactive_codes, retention_days)
+                if archived:
+                    _LOGGER.info("Archived %d shipments older than %d days", archived, retention_days)
+        except Exception as e:
+            _LOGGER.error("Shipment retention run failed: %s", str(e))
+
+    async def _in_chunks(self, operation, days):
+        older_than = datetime.now() - timedelta(days=days)
+        total = 0
+        while True:
+            count = await operation(older_than, RETENTION_CHUNK_SIZE)
+            total += count
+            if count < RETENTION_CHUNK_SIZE:
+                return total
+            await asyncio.sleep(RETENTION_CHUNK_PAUSE)
@@ -0,0 +1,31 @@
+import hashlib
+from collections import deque
+from datetime import datetime, timezone
+from .const import SCAN_LOG_SIZE
+
+def hash_code(code):
+    """Return a short, stable digest identifying a code without revealing it."""
+    return hashlib.sha256(code.encode()).hexdigest()[:16]
+
+class ScanLog:
+    """Fixed-size ring buffer of the most recent scans, newest first."""
+
+    def __init__(self, size=SCAN_LOG_SIZE):
+        self._entries = deque(maxlen=size)
+
+    def record(self, code_hash, result, latency_ms, topic, rule=None):
+        """Add a scan; rule is how an authorized scan matched its stored code."""
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "code_hash": code_hash,
+            "result": result,
+            "latency_ms": latency_ms,
+            "topic": topic,
+            "rule": rule,
+        }
+        self._entries.appendleft(entry)
+        return entry
+
+    def as_list(self, limit=None):
+        entries = list(self._entries)
+        return entries if limit is None else entries[:limit]
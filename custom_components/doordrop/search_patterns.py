@@ -1,22 +1,126 @@
 import re
-import logging
-
-_LOGGER = logging.getLogger(__name__)
-
-def find_tracking_code(provider, body, patterns):
-    """Find the tracking code for a specific provider using defined patterns."""
-    if provider not in patterns:
-        _LOGGER.warning("No patterns found for provider %s", provider)
-        return None
-
-    provider_patterns = patterns[provider]
-    if not isinstance(provider_patterns, list):
-        provider_patterns = [provider_patterns]
-
-    for pattern in provider_patterns:
-        if match := re.search(pattern, body):
-            _LOGGER.info(f"Found tracking code for {provider}: {match.group()}")
-            return match.group()
-    
-    _LOGGER.warning(f"No tracking code found for provider {provider} in the provided body")
-    return None
+import time
+from typing import NamedTuple
+from .const import CODE_MAX_LENGTH
+
+# Candidate codes are whole alphanumeric tokens, which anchors every pattern at word boundaries
+TOKEN_MIN_LENGTH = 8
+TOKEN_PATTERN = re.compile(rf"[A-Za-z0-9]{{{TOKEN_MIN_LENGTH},}}")
+PROXIMITY_WINDOW = 200  # characters around a provider keyword or tracking label that earn a bonus
+PROXIMITY_WEIGHT = 4
+PREFIX_WEIGHT = 2  # per literal character a pattern requires at the start of the code
+FIXED_LENGTH_BONUS = 3
+CHECKSUM_BONUS = 2
+
+# Joins subject and body so that no pattern can match across them: "." stops at
+# the newlines and "\s" does not match the NUL between them.
+SUBJECT_BODY_SEPARATOR = "\n\x00\n"
+
+class ProviderClassifier:
+    """Identify the providers mentioned in an email with patterns compiled once."""
+
+    def __init__(self, provider_patterns):
+        self._compiled = [
+            (provider, re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE))
+            for provider, patterns in provider_patterns.items()
+        ]
+
+    def identify(self, subject, body, stats=None):
+        """Return the providers matching the subject or body, in definition order.
+
+        If stats is a dict, (hits, seconds) per provider keyword group are added to it.
+        """
+        text = f"{subject}{SUBJECT_BODY_SEPARATOR}{body}"
+        if stats is None:
+            return [provider for provider, regex in self._compiled if regex.search(text)]
+        providers = []
+        for provider, regex in self._compiled:
+            start = time.perf_counter()
+            found = regex.search(text) is not None
+            stats[f"{provider} keywords"] = (int(found), time.perf_counter() - start)
+            if found:
+                providers.append(provider)
+        return providers
+
+class TrackingCandidate(NamedTuple):
+    code: str
+    provider: str
+    score: float
+    position: int
+
+def literal_prefix(pattern):
+    """Return the literal characters a pattern requires before its first regex construct."""
+    match = re.match(r"[A-Za-z0-9]*", pattern)
+    return match.group()
+
+def _pattern_specificity(pattern):
+    specificity = PREFIX_WEIGHT * len(literal_prefix(pattern))
+    if not re.search(r"[*+?]|\{\d+,\}", pattern):
+        specificity += FIXED_LENGTH_BONUS
+    return specificity
+
+def has_gs1_check_digit(code):
+    """Return True if a numeric code ends with a valid GS1 mod-10 check digit."""
+    if not code.isdigit() or len(code) < 2:
+        return False
+    total = sum(int(digit) * (3 if index % 2 == 0 else 1) for index, digit in enumerate(reversed(code[:-1])))
+    return (10 - total % 10) % 10 == int(code[-1])
+
+class TrackingCodeExtractor:
+    """Find and rank tracking code candidates for all identified providers in one scan."""
+
+    def __init__(self, patterns, provider_patterns, labels):
+        self._patterns = {}
+        for provider, provider_code_patterns in patterns.items():
+            if not isinstance(provider_code_patterns, list):
+                provider_code_patterns = [provider_code_patterns]
+            self._patterns[provider] = [
+                (pattern, re.compile(pattern), _pattern_specificity(pattern)) for pattern in provider_code_patterns
+            ]
+        context_patterns = [pattern for keywords in provider_patterns.values() for pattern in keywords] + list(labels)
+        self._context = re.compile("|".join(f"(?:{pattern})" for pattern in context_patterns), re.IGNORECASE)
+
+    def extract(self, body, providers, stats=None):
+        """Return candidates for the given providers, best first, one entry per code.
+
+        If stats is a dict, (hits, seconds) per code pattern are added to it.
+        """
+        compiled = [
+            (provider, pattern, regex, specificity)
+            for provider in providers
+            for pattern, regex, specificity in self._patterns.get(provider, [])
+        ]
+        if not compiled:
+            return []
+
+        # Longer tokens cannot be stored as shipment codes
+        tokens = [(token.group(), token.start()) for token in TOKEN_PATTERN.finditer(body) if len(token.group()) <= CODE_MAX_LENGTH]
+        anchors = None
+        best = {}
+        for provider, pattern, regex, specificity in compiled:
+            start = time.perf_counter()
+            hits = 0
+            for code, position in tokens:
+                if not regex.fullmatch(code):
+                    continue
+                hits += 1
+                if anchors is None:
+                    anchors = [match.start() for match in self._context.finditer(body)]
+                score = specificity + self._proximity(anchors, position)
+                if has_gs1_check_digit(code):
+                    score += CHECKSUM_BONUS
+                # Ties go to the earliest occurrence, then to the first pattern
+                current = best.get(code)
+                if current is None or score > current.score or (score == current.score and position < current.position):
+                    best[code] = TrackingCandidate(code, provider, score, position)
+            if stats is not None:
+                stats[f"{provider}: {pattern}"] = (hits, time.perf_counter() - start)
+
+        return sorted(best.values(), key=lambda candidate: (-candidate.score, candidate.position))
+
+    @staticmethod
+    def _proximity(anchors, position):
+        if not anchors:
+            return 0
+        distance = min(abs(position - anchor) for anchor in anchors)
+        return PROXIMITY_WEIGHT * max(0.0, 1 - distance / PROXIMITY_WINDOW)
@@ -1,23 +1,27 @@
-import mysql.connector
-import imaplib
-import email
-import re
 import asyncio
-from datetime import datetime, timedelta
 import logging
+import threading
+import time
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.util import dt as dt_util
 from homeassistant.helpers.entity import Entity
-from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
 from homeassistant.components.mqtt import async_publish, async_subscribe
 from homeassistant.const import ATTR_ATTRIBUTION
 from .const import (
     CONF_IMAP_HOST, CONF_IMAP_PORT, CONF_IMAP_USERNAME, CONF_IMAP_PASSWORD,
     CONF_DB_HOST, CONF_DB_PORT, CONF_DB_USERNAME, CONF_DB_PASSWORD, CONF_DB_NAME,
     CONF_SCAN_INTERVAL, CONF_MQTT_TOPIC, CONF_MQTT_STATUS_TOPIC, AUTHORIZED_BARCODES,
-    DOMAIN
+    CONF_PARSER_WORKERS, DEFAULT_PARSER_WORKERS, WRITE_BEHIND_RETRY_INTERVAL, IMAP_MAX_CONCURRENT_FETCHES, DOMAIN,
+    EVENT_SCAN, SCAN_LOG_ATTRIBUTE_SIZE
 )
-from .patterns import PATTERNS, CUSTOM_PATTERNS
-from .search_patterns import find_tracking_code
+from .mail import MailWatcher, UidCheckpoint, mail_sources
+from .pipeline import MailPipeline
+from .write_behind import DeactivationQueue
+from .dispatcher import ScanDispatcher
+from .retention import RetentionPolicy
+from .scan_log import hash_code
+from .authorizer import CodeAuthorizer, count_db_error
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -46,25 +50,23 @@ async def async_setup_entry(hass: HomeAssistant, config_entry, async_add_entitie
             _LOGGER.error("Missing required configuration fields: %s", missing_fields)
             return False
 
-        imap_username = config[CONF_IMAP_USERNAME]
-        imap_password = config[CONF_IMAP_PASSWORD]
-        imap_host = config[CONF_IMAP_HOST]
-        imap_port = config[CONF_IMAP_PORT]
-        db_host = config[CONF_DB_HOST]
-        db_port = config[CONF_DB_PORT]
-        db_username = config[CONF_DB_USERNAME]
-        db_password = config[CONF_DB_PASSWORD]
-        db_name = config[CONF_DB_NAME]
+        sources = mail_sources(config, config_entry.options)
         scan_interval = config[CONF_SCAN_INTERVAL]
         mqtt_topic = config[CONF_MQTT_TOPIC]
         mqtt_status_topic = config[CONF_MQTT_STATUS_TOPIC]
-        authorized_barcodes = config.get(AUTHORIZED_BARCODES, "")
+        authorized_barcodes = hass.data[DOMAIN][config_entry.entry_id]['authorized_barcodes']
+        parser_workers = config.get(CONF_PARSER_WORKERS, DEFAULT_PARSER_WORKERS)
+        database = hass.data[DOMAIN][config_entry.entry_id]['database']
+        metrics = hass.data[DOMAIN][config_entry.entry_id]['metrics']
+        fallback = hass.data[DOMAIN][config_entry.entry_id]['fallback']
+        mail_checkpoint = UidCheckpoint(hass, config_entry.entry_id)
 
         _LOGGER.debug("Creating ShipmentTrackerSensor")
         sensor = ShipmentTrackerSensor(
-            hass, "Shipment Tracker", imap_username, imap_password, imap_host, imap_port,
-            db_host, db_port, db_username, db_password, db_name,
-            scan_interval, mqtt_topic, mqtt_status_topic, authorized_barcodes
+            hass, "Shipment Tracker", sources, database, scan_interval, mqtt_topic, mqtt_status_topic, authorized_barcodes, mail_checkpoint,
+            parser_workers, metrics, config_entry, fallback, hass.data[DOMAIN][config_entry.entry_id]['patterns'],
+            hass.data[DOMAIN][config_entry.entry_id]['code_index'], hass.data[DOMAIN][config_entry.entry_id]['scan_log'],
+            hass.data[DOMAIN][config_entry.entry_id]['mail_batches']
         )
 
         _LOGGER.debug("Adding sensor entity")
@@ -78,31 +80,54 @@ async def async_setup_entry(hass: HomeAssistant, config_entry, async_add_entitie
         _LOGGER.error("Error setting up DoorDrop sensor platform: %s", str(e), exc_info=True)
         return False
 
+def pair_scanner_topics(mqtt_topic, mqtt_status_topic):
+    """Map each comma separated scan topic to its status topic.
+
+    Status topics are paired with scan topics by position; a single status
+    topic is shared by all scanners.
+    """
+    topics = [topic.strip() for topic in mqtt_topic.split(",") if topic.strip()]
+    status_topics = [topic.strip() for topic in mqtt_status_topic.split(",") if topic.strip()]
+    if len(status_topics) != len(topics):
+        if len(status_topics) != 1:
+            _LOGGER.error("Expected one status topic or one per scan topic, using %s for all scanners", status_topics[0])
+        status_topics = status_topics[:1] * len(topics)
+    return dict(zip(topics, status_topics))
+
 class ShipmentTrackerSensor(Entity):
-    def __init__(self, hass, name, imap_username, imap_password, imap_host, imap_port, db_host, db_port, db_username, db_password, db_name, scan_interval, mqtt_topic, mqtt_status_topic, authorized_barcodes):
+    # The scan list changes with every state write; the doordrop_scan events already record it.
+    # Metrics and mail batch results are in the diagnostics download and the Prometheus endpoint instead.
+    _unrecorded_attributes = frozenset({"recent_scans"})
+
+    def __init__(self, hass, name, sources, database, scan_interval, mqtt_topic, mqtt_status_topic, authorized_barcodes, mail_checkpoint, parser_workers, metrics, config_entry, fallback, pattern_registry, code_index, scan_log, mail_batches):
         self.hass = hass
         self._name = name
         self._state = None
-        self._imap_host = imap_host
-        self._imap_port = imap_port
-        self._imap_username = imap_username
-        self._imap_password = imap_password
-        self._db_host = db_host
-        self._db_port = db_port
-        self._db_username = db_username
-        self._db_password = db_password
-        self._db_name = db_name
-        self._mqtt_topic = mqtt_topic
-        self._mqtt_status_topic = mqtt_status_topic
-        self._authorized_barcodes = authorized_barcodes
-        self._coordinator = DataUpdateCoordinator(
-            hass,
-            _LOGGER,
-            name="doordrop",
-            update_method=self._async_update,
-            update_interval=timedelta(minutes=scan_interval)
-        )
-        self._patterns = PATTERNS
+        self._database = database
+        self._fallback = fallback
+        self._metrics = metrics
+        self._scan_log = scan_log
+        self._status_topics = pair_scanner_topics(mqtt_topic, mqtt_status_topic)
+        self._subscriptions = []
+        # One watcher per account folder; they share a bound on concurrent fetches
+        fetch_slots = threading.BoundedSemaphore(IMAP_MAX_CONCURRENT_FETCHES)
+        self._mail_watchers = [
+            MailWatcher(
+                hass, source.host, source.port, source.username, source.password,
+                scan_interval * 60, self.process_emails, mail_checkpoint, metrics, folder, fetch_slots
+            )
+            for source in sources
+            for folder in source.folders
+        ]
+        self._mail_checkpoint = mail_checkpoint
+        self._mail_start = None
+        self._pipeline = MailPipeline(hass, self.store_codes, metrics, pattern_registry, parser_workers)
+        self._coordinator = mail_batches
+        self._code_index = code_index
+        self._deactivations = DeactivationQueue(hass, database, config_entry.entry_id, metrics)
+        self._retention = RetentionPolicy(hass, config_entry, database, self._code_index.async_resync)
+        self._authorizer = CodeAuthorizer(hass, database, code_index, self._deactivations, authorized_barcodes, metrics, fallback)
+        self._dispatcher = ScanDispatcher(hass, self._authorizer.authorize, metrics)
 
     @property
     def name(self):
@@ -116,243 +141,164 @@ class ShipmentTrackerSensor(Entity):
     def state(self):
         return self._state
 
+    @property
+    def should_poll(self):
+        return False
+
+    @property
+    def extra_state_attributes(self):
+        return {"recent_scans": self._scan_log.as_list(SCAN_LOG_ATTRIBUTE_SIZE)}
+
     def update_status(self, status):
+        """Set the state, writing it only when it changes."""
+        if status == self._state:
+            return
         _LOGGER.debug("Updating status to: %s", status)
         self._state = status
         _LOGGER.debug("Calling async_write_ha_state()")
-        self.async_write_ha_state()
+        with self._metrics.timer("scan_state_write"):
+            self.async_write_ha_state()
         _LOGGER.debug("State updated to: %s", self._state)
 
     async def async_added_to_hass(self):
+        """Get the gate answering scans first; mail ingestion starts in the background."""
         _LOGGER.debug("Adding to hass: %s", self._name)
-        await self._coordinator.async_config_entry_first_refresh()
-        try:
-            self._subscription = await async_subscribe(self.hass, self._mqtt_topic, self.on_message)
-            _LOGGER.debug("Subscribed to MQTT topic: %s", self._mqtt_topic)
-        except Exception as e:
-            _LOGGER.error("Failed to subscribe to MQTT topic: %s", str(e))
-            self._subscription = None
-        _LOGGER.debug("Subscription set to: %s", self._subscription)
+        # Pending deactivations come from local storage; they must be known before the first scan
+        await self._deactivations.async_start()
+        # Scans arriving before the index is loaded are looked up in the database
+        for topic in self._status_topics:
+            try:
+                self._subscriptions.append(await async_subscribe(self.hass, topic, self.on_message))
+                _LOGGER.debug("Subscribed to MQTT topic: %s", topic)
+            except Exception as e:
+                _LOGGER.error("Failed to subscribe to MQTT topic %s: %s", topic, str(e))
+        await self._code_index.async_start()
+        self._retention.async_start()
+        if self._fallback is not None:
+            self.async_on_remove(async_track_time_interval(self.hass, self.replay_buffered_codes, WRITE_BEHIND_RETRY_INTERVAL))
+        self._mail_start = self.hass.async_create_background_task(self._async_start_mail(), "doordrop_mail_start")
+
+    async def _async_start_mail(self):
+        await self._mail_checkpoint.async_load()
+        self._pipeline.start()
+        for watcher in self._mail_watchers:
+            watcher.start()
 
     async def async_will_remove_from_hass(self):
         _LOGGER.debug("Removing from hass: %s", self._name)
-        if self._subscription is not None:
+        if self._mail_start is not None and not self._mail_start.done():
+            self._mail_start.cancel()
+        self._code_index.async_stop()
+        self._retention.async_stop()
+        await asyncio.gather(*(watcher.async_stop() for watcher in self._mail_watchers))
+        await self._pipeline.async_stop()
+        await self._deactivations.async_stop()
+        for unsubscribe in self._subscriptions:
             try:
-                _LOGGER.debug("Unsubscribing from MQTT topic: %s", self._mqtt_topic)
-                await self._subscription()
+                unsubscribe()
             except Exception as e:
                 _LOGGER.error("Error unsubscribing from MQTT: %s", e)
-        else:
-            _LOGGER.debug("Subscription is None, nothing to unsubscribe.")
+        self._subscriptions = []
         _LOGGER.debug("Sensor %s removed from hass", self._name)
 
     async def on_message(self, message):
         """Handle incoming MQTT messages."""
+        start = time.perf_counter()
         try:
             _LOGGER.debug("Received MQTT message: %s", message)
             payload = message.payload.decode() if isinstance(message.payload, bytes) else message.payload
             _LOGGER.info("Received message on %s: %s", message.topic, payload)
-            await self.process_code(payload)
+            await self.process_code(payload, message.topic)
         except Exception as e:
             _LOGGER.error("Error processing MQTT message: %s", str(e))
-
-    async def process_code(self, code):
-        """Process the scanned code and update the system state."""
-        _LOGGER.debug("Processing code %s", code)
-        is_authorized = await self.is_code_in_database(code) or self.is_authorized_barcode(code)
-        if is_authorized:
-            await self.update_code_status(code, False)
-            self.update_status("authorized")
-            _LOGGER.debug("Publishing Authorized to MQTT")
-            await self.publish_status("Authorized")
-            self.update_status("none")
-        else:
-            self.update_status("unauthorized")
-            _LOGGER.debug("Publishing Unauthorized to MQTT")
-            await self.publish_status("Unauthorized")
-            self.update_status("none")
-
-    async def _async_update(self):
-        """A wrapper to run the synchronous update method in the executor."""
-        _LOGGER.debug("Running async update")
-        await self.hass.async_add_executor_job(self.update)
-
-    def update(self):
-        """Update the sensor by checking for new emails and processing them."""
-        _LOGGER.debug("Updating sensor: %s", self._name)
-        try:
-            server = imaplib.IMAP4_SSL(self._imap_host, self._imap_port)
-            server.login(self._imap_username, self._imap_password)
-            server.select("inbox")
-            status, messages = server.search(None, "UNSEEN")
-            for num in messages[0].split():
-                status, msg_data = server.fetch(num, "(RFC822)")
-                for response_part in msg_data:
-                    if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1])
-                        subject = msg["subject"]
-                        body = self._get_email_body(msg)
-                        if body:  # Ensure body is not None
-                            try:
-                                providers = self.identify_providers(subject, body)
-                                extracted_code = None
-                                for provider in providers:
-                                    extracted_code = find_tracking_code(provider, body, self._patterns)
-                                    if extracted_code:
-                                        break
-                                if extracted_code:
-                                    asyncio.run_coroutine_threadsafe(self._run_db_task(extracted_code), self.hass.loop)
-                            except re.error as e:
-                                _LOGGER.error("Error in regex pattern: %s", str(e))
-            server.close()
-            server.logout()
-        except Exception as e:
-            _LOGGER.error("Error in email fetching or processing: %s", str(e))
-
-    def _get_email_body(self, msg):
-        """Extract the body from the email message."""
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition"))
-                if "attachment" not in content_disposition:
-                    if content_type == "text/plain":
-                        return part.get_payload(decode=True).decode()
-        else:
-            return msg.get_payload(decode=True).decode()
-        return None
-
-    def identify_providers(self, subject, body):
-        """Identify providers based on the subject and body content."""
-        providers = []
-
-        _LOGGER.debug("Subject: %s", subject)
-        _LOGGER.debug("Body: %s", body)
-
-        for provider, patterns in CUSTOM_PATTERNS.items():
-            for pattern in patterns:
-                subject_match = re.search(pattern, subject, re.IGNORECASE)
-                body_match = re.search(pattern, body, re.IGNORECASE)
-                _LOGGER.debug("Testing pattern '%s' for provider '%s'", pattern, provider)
-                if subject_match or body_match:
-                    _LOGGER.debug("Match found for provider '%s' with pattern '%s'", provider, pattern)
-                    providers.append(provider)
-                    break
-                else:
-                    _LOGGER.debug("No match for provider '%s' with pattern '%s'", provider, pattern)
-
-        return providers
-
-    def is_authorized_barcode(self, barcode):
-        """Check if the barcode is in the list of authorized barcodes."""
-        _LOGGER.debug("Checking if barcode is authorized: %s", barcode)
-        return barcode in self._authorized_barcodes.split(",")
-
-    async def is_code_in_database(self, code):
-        """Check if the code exists in the database and is active asynchronously."""
-        _LOGGER.debug("Checking if code is in database: %s", code)
-        return await self.hass.async_add_executor_job(self._is_code_in_database_blocking, code)
-
-    def _is_code_in_database_blocking(self, code):
-        """Check if the code exists in the database and is active (synchronous version)."""
-        conn = None
-        cursor = None
-        try:
-            conn = mysql.connector.connect(
-                host=self._db_host,
-                port=self._db_port,
-                user=self._db_username,
-                password=self._db_password,
-                database=self._db_name
-            )
-            cursor = conn.cursor()
-            _LOGGER.debug("Checking if code %s is in the database and active.", code)
-            cursor.execute("SELECT active FROM shipments WHERE code = %s", (code,))
-            result = cursor.fetchone()
-            if result is None:
-                _LOGGER.info("Code %s not found in the database.", code)
-                return False
-            return result[0]  # This directly returns True if active, False otherwise
-        except Exception as e:
-            _LOGGER.error("Error checking code in the database: %s", str(e))
-            return False
         finally:
-            if cursor is not None:
-                cursor.close()
-            if conn is not None and conn.is_connected():
-                conn.close()
+            self._metrics.observe("scan_total", time.perf_counter() - start)
 
-    async def _run_db_task(self, code):
+    async def process_code(self, code, topic=None):
+        """Authorize the scanned code, answer the scanner and fire one doordrop_scan event."""
+        _LOGGER.debug("Processing code %s", code)
+        start = time.perf_counter()
+        if topic is None:
+            topic = next(iter(self._status_topics))
+        match = await self._dispatcher.dispatch(code, topic)
+        status_topic = self._status_topics.get(topic) or next(iter(self._status_topics.values()))
+        result = "authorized" if match is not None else "unauthorized"
+        self._metrics.increment(f"scans_{result}")
+        if match is not None and match.rule not in ("exact", "allowlist"):
+            self._metrics.increment("scans_tolerant_match")
+        _LOGGER.debug("Publishing %s to MQTT", result)
+        with self._metrics.timer("scan_publish"):
+            await self.publish_status(result.capitalize(), status_topic)
+        latency_ms = round((time.perf_counter() - start) * 1000, 1)
+        entry = self._scan_log.record(hash_code(code), result, latency_ms, topic, match.rule if match is not None else None)
+        self.hass.bus.async_fire(EVENT_SCAN, entry)
+        self.update_status(result)
+
+    def process_emails(self, messages):
+        """Queue raw RFC822 messages for parsing (runs in the mail watcher thread)."""
+        _LOGGER.debug("Processing %d new emails", len(messages))
+        for raw_message in messages:
+            self._pipeline.submit(raw_message)
+
+    async def store_codes(self, candidates):
+        """Store a batch of tracking codes extracted by the parsing pipeline."""
+        codes = [candidate.code for candidate in candidates]
+        _LOGGER.debug("Storing %d codes in database", len(codes))
         try:
-            _LOGGER.debug("Running DB task for code: %s", code)
-            await self.hass.async_add_executor_job(self.__run_db_task_blocking, code)
+            with self._metrics.timer("mail_db_write"):
+                result = await self._database.upsert_codes(codes)
         except Exception as e:
             _LOGGER.error("Database operation failed: %s", str(e))
-
-    def __run_db_task_blocking(self, code):
-        """Function to run the DB task that potentially blocks, ensuring proper handling of database operations."""
-        conn = None
-        cursor = None
+            count_db_error(self._metrics, e)
+            self._coordinator.async_set_update_error(e)
+            await self._buffer_codes(codes)
+            return
+        for code in result.active:
+            self._code_index.add(code)
+        _LOGGER.info("Stored %d codes in database: %d new, %d already known", len(codes), result.inserted, result.duplicates)
+        self._coordinator.async_set_updated_data({
+            "at": dt_util.utcnow().isoformat(),
+            "codes": result.inserted + result.duplicates,
+            "inserted": result.inserted,
+            "duplicates": result.duplicates,
+        })
+
+    async def _buffer_codes(self, codes):
+        """Keep mail codes locally, and accept them at the gate, until the database is back."""
+        if self._fallback is None:
+            return
         try:
-            conn = mysql.connector.connect(
-                host=self._db_host,
-                port=self._db_port,
-                user=self._db_username,
-                password=self._db_password,
-                database=self._db_name
-            )
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS shipments (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    code VARCHAR(255) UNIQUE,
-                    date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    active BOOLEAN DEFAULT TRUE,
-                    checked_date TIMESTAMP NULL
-                );
-            """)
-            cursor.execute("INSERT INTO shipments (code) VALUES (%s) ON DUPLICATE KEY UPDATE code=VALUES(code)", (code,))
-            conn.commit()
-            _LOGGER.info(f"Added or updated code in database: {code}")
+            await self._fallback.async_buffer_inserts(codes)
         except Exception as e:
-            _LOGGER.error("Error in database operation: %s", str(e))
-        finally:
-            if cursor is not None:
-                cursor.close()
-            if conn is not None and conn.is_connected():
-                conn.close()
-
-    async def update_code_status(self, code, active):
-        """Update the active status of a shipment code in the database asynchronously."""
-        _LOGGER.debug("Updating code status in database: %s, active: %s", code, active)
-        await self.hass.async_add_executor_job(self._update_code_status, code, active)
-
-    def _update_code_status(self, code, active):
-        """Update the active status of a shipment code in the database synchronously."""
-        conn = None
-        cursor = None
+            _LOGGER.error("Error buffering codes in the local fallback store: %s", str(e))
+            return
+        for code in codes:
+            self._code_index.add(code)
+        _LOGGER.warning("Buffered %d codes locally for replay once the database is available", len(codes))
+
+    async def replay_buffered_codes(self, now=None):
+        """Write codes buffered during a database outage; those used meanwhile are written inactive."""
         try:
-            conn = mysql.connector.connect(
-                host=self._db_host,
-                port=self._db_port,
-                user=self._db_username,
-                password=self._db_password,
-                database=self._db_name
-            )
-            cursor = conn.cursor()
-            cursor.execute("UPDATE shipments SET active = %s, checked_date = %s WHERE code = %s", (active, datetime.now(), code))
-            conn.commit()
+            codes = await self._fallback.async_pending_inserts()
+            if not codes:
+                return
+            used = set(await self._fallback.async_used_codes())
+            used.update(code for code in codes if self._deactivations.is_tombstoned(code))
+            result = await self._database.upsert_codes(codes, used)
+            await self._fallback.async_remove_pending(codes)
         except Exception as e:
-            _LOGGER.error("Error updating code status in the database: %s", str(e))
-            if conn:
-                conn.rollback()  # Important to rollback in case of failure
-        finally:
-            if cursor is not None:
-                cursor.close()
-            if conn is not None and conn.is_connected():
-                conn.close()
-
-    async def publish_status(self, status):
-        """Publish the status to the MQTT topic using Home Assistant's MQTT."""
-        _LOGGER.debug("Publishing status to MQTT: %s", status)
-        await async_publish(self.hass, self._mqtt_status_topic, status)
+            _LOGGER.debug("Replaying buffered codes failed, will retry: %s", str(e))
+            return
+        active = set(result.active)
+        for code in codes:
+            # Buffered codes that turn out to be used already must not stay valid
+            if code in active:
+                self._code_index.add(code)
+            else:
+                self._code_index.discard(code)
+        _LOGGER.info("Replayed %d buffered codes: %d new, %d already known", len(codes), result.inserted, result.duplicates)
+
+    async def publish_status(self, status, status_topic):
+        """Publish the status to the scanner's status topic using Home Assistant's MQTT."""
+        _LOGGER.debug("Publishing status to MQTT %s: %s", status_topic, status)
+        await async_publish(self.hass, status_topic, status)
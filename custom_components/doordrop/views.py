@@ -0,0 +1,18 @@
+from aiohttp import web
+from homeassistant.components.http import HomeAssistantView
+from homeassistant.helpers.http import KEY_HASS
+from .const import DOMAIN
+
+class DoorDropMetricsView(HomeAssistantView):
+    """Prometheus-style text dump of the scan and mail metrics of every config entry."""
+
+    url = "/api/doordrop/metrics"
+    name = "api:doordrop:metrics"
+
+    async def get(self, request):
+        hass = request.app[KEY_HASS]
+        text = "".join(
+            data['metrics'].prometheus_text(f'entry="{entry_id}"')
+            for entry_id, data in hass.data.get(DOMAIN, {}).items()
+        )
+        return web.Response(text=text, content_type="text/plain")
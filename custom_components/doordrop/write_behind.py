@@ -0,0 +1,110 @@
+import logging
+import time
+from datetime import datetime
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.storage import Store
+from .const import DOMAIN, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_RETRY_INTERVAL, TOMBSTONE_TTL, DEACTIVATION_MISSING_MAX_AGE
+
+_LOGGER = logging.getLogger(__name__)
+
+DEACTIVATIONS_VERSION = 1
+
+class DeactivationQueue:
+    """Durable write-behind queue of used codes waiting to be marked inactive.
+
+    A queued code is tombstoned immediately, so it cannot authorize a second
+    scan even if an index resync still sees it as active. Pending writes are
+    persisted in HA storage, flushed to the shipments table in batches and
+    retried until they succeed. Tombstones outlive the flush by TOMBSTONE_TTL
+    to cover a resync snapshot read before the write committed. A code not
+    yet in the table, e.g. a mail code buffered during an outage, stays
+    queued for up to DEACTIVATION_MISSING_MAX_AGE until its row exists.
+    """
+
+    def __init__(self, hass: HomeAssistant, database, entry_id, metrics, store=None):
+        """store defaults to the entry's Home Assistant storage file."""
+        self.hass = hass
+        self._database = database
+        self._metrics = metrics
+        self._store = store or Store(hass, DEACTIVATIONS_VERSION, f"{DOMAIN}.{entry_id}.deactivations")
+        self._pending = {}
+        self._flushed = {}
+        self._flushing = False
+        self._unsub_retry = None
+
+    async def async_start(self):
+        data = await self._store.async_load() or {}
+        self._pending = {**data.get("pending", {}), **self._pending}
+        self._unsub_retry = async_track_time_interval(self.hass, self.async_flush, WRITE_BEHIND_RETRY_INTERVAL)
+        if self._pending:
+            _LOGGER.info("Replaying %d queued code deactivations", len(self._pending))
+            self.hass.async_create_task(self.async_flush())
+
+    async def async_stop(self):
+        if self._unsub_retry is not None:
+            self._unsub_retry()
+            self._unsub_retry = None
+        await self.async_flush()
+        await self._store.async_save(self._data_to_save())
+
+    def is_tombstoned(self, code):
+        if code in self._pending:
+            return True
+        flushed_at = self._flushed.get(code)
+        return flushed_at is not None and time.monotonic() - flushed_at < TOMBSTONE_TTL
+
+    @callback
+    def enqueue(self, code):
+        """Tombstone a code and queue its deactivation."""
+        self._pending[code] = datetime.now().isoformat()
+        self._store.async_delay_save(self._data_to_save, 0)
+        self.hass.async_create_task(self.async_flush())
+
+    @callback
+    def cancel(self, code):
+        """Drop a queued deactivation and tombstone, e.g. when a code is reactivated."""
+        self._pending.pop(code, None)
+        self._flushed.pop(code, None)
+        self._store.async_delay_save(self._data_to_save, 0)
+
+    async def async_flush(self, now=None):
+        """Write each queued deactivation once, in batches, until all were tried or a write fails."""
+        if self._flushing:
+            return
+        self._flushing = True
+        try:
+            attempted = set()
+            while True:
+                batch = dict([item for item in self._pending.items() if item[0] not in attempted][:WRITE_BEHIND_BATCH_SIZE])
+                if not batch:
+                    break
+                attempted.update(batch)
+                try:
+                    missing = set(await self._database.deactivate_codes(
+                        {code: datetime.fromisoformat(checked) for code, checked in batch.items()}
+                    ))
+                except Exception as e:
+                    _LOGGER.warning("Deactivating %d codes failed, will retry: %s", len(batch), str(e))
+                    self._metrics.increment("deactivation_retries")
+                    return
+                flushed_at = time.monotonic()
+                for code, checked in batch.items():
+                    # Not in the table yet, e.g. a buffered mail code: it stays queued and tombstoned
+                    if code in missing and datetime.now() - datetime.fromisoformat(checked) < DEACTIVATION_MISSING_MAX_AGE:
+                        continue
+                    # A code queued again during the write keeps its newer entry
+                    if self._pending.get(code) == checked:
+                        del self._pending[code]
+                    self._flushed[code] = flushed_at
+                self._store.async_delay_save(self._data_to_save, 0)
+            self._prune_tombstones()
+        finally:
+            self._flushing = False
+
+    def _prune_tombstones(self):
+        now = time.monotonic()
+        self._flushed = {code: at for code, at in self._flushed.items() if now - at < TOMBSTONE_TTL}
+
+    def _data_to_save(self):
+        return {"pending": dict(self._pending)}